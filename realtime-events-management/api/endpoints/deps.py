@@ -1,30 +1,130 @@
+import time
+from typing import Optional
+
 import fastapi
+import sqlalchemy as sa
 from fastapi import security as fastapi_security
 from fastapi import status as fastapi_status
-from sqlalchemy import orm as sa_orm
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.sql import expression
 
+from core import cache
 from core import database
+from core import metrics
+from core import ratelimit
 from core import security
+from core import settings
 from models import users
+from schemas import users as users_schemas
 
 oauth2_scheme = fastapi_security.OAuth2PasswordBearer(tokenUrl="auth/token")
+optional_oauth2_scheme = fastapi_security.OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
+
+# token -> (decoded claims, user snapshot); entries never outlive the token.
+token_cache = cache.TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+metrics.register_cache(token_cache, "token")
+
+user_rate_limiter = ratelimit.RateLimiter(
+    settings.RATE_LIMIT_USER_RATE, settings.RATE_LIMIT_USER_BURST, settings.RATE_LIMIT_MAX_KEYS
+)
+address_rate_limiter = ratelimit.RateLimiter(
+    settings.RATE_LIMIT_ADDRESS_RATE, settings.RATE_LIMIT_ADDRESS_BURST, settings.RATE_LIMIT_MAX_KEYS
+)
 
 async def get_current_user(
     token: str = fastapi.Depends(oauth2_scheme),
-    db: sa_orm.Session = fastapi.Depends(database.get_db)
-) -> users.User:
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db)
+) -> users_schemas.User:
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached[1]
+
     credentials_exception = fastapi.HTTPException(
         status_code=fastapi_status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    user_id = security.verify_token(token)
-    if user_id is None:
+
+    claims = security.decode_token(token)
+    if claims is None or claims.get("sub") is None:
         raise credentials_exception
-        
-    user = db.query(users.User).filter(users.User.id == user_id).first()
+
+    user = await db.scalar(expression.select(users.User).where(users.User.id == claims["sub"]))
     if user is None:
         raise credentials_exception
-        
-    return user
+
+    snapshot = users_schemas.User.model_validate(user)
+    expires_in = claims["exp"] - time.time() if "exp" in claims else None
+    token_cache.set(token, (claims, snapshot), ttl=expires_in)
+    return snapshot
+
+
+def too_many_requests(retry_after: float, reason: str) -> fastapi.HTTPException:
+    metrics.HTTP_REQUESTS_THROTTLED.inc(reason)
+    return fastapi.HTTPException(
+        status_code=fastapi_status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, round(retry_after)))},
+    )
+
+
+# For write endpoints: the current user, once they are within their rate limit.
+async def get_throttled_user(
+    current_user: users_schemas.User = fastapi.Depends(get_current_user),
+) -> users_schemas.User:
+    retry_after = user_rate_limiter.acquire(current_user.id)
+    if retry_after:
+        raise too_many_requests(retry_after, "user")
+    return current_user
+
+
+# For write endpoints: also sends the user's reads to the primary for a while,
+# so they see their own changes despite replica lag.
+async def get_writing_user(
+    current_user: users_schemas.User = fastapi.Depends(get_throttled_user),
+) -> users_schemas.User:
+    database.read_routing.wrote(current_user.id)
+    return current_user
+
+
+def get_reader_id(token: Optional[str] = fastapi.Depends(optional_oauth2_scheme)) -> Optional[int]:
+    # Only decides where a read goes, so a bad token just reads from a replica.
+    if token is None:
+        return None
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached[1].id
+    user_id = security.verify_token(token)
+    return int(user_id) if user_id is not None else None
+
+
+# Read-only sessions for GET endpoints, on a replica when there are any.
+def get_read_db(user_id: Optional[int] = fastapi.Depends(get_reader_id)):
+    db = database.read_routing.session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_async_sessionmaker(
+    user_id: Optional[int] = fastapi.Depends(get_reader_id),
+) -> sa_asyncio.async_sessionmaker:
+    return database.read_routing.async_sessionmaker(user_id)
+
+
+# For endpoints used before there is a user, such as login and registration.
+def throttle_address(request: fastapi.Request):
+    retry_after = address_rate_limiter.acquire(request.client.host if request.client else None)
+    if retry_after:
+        raise too_many_requests(retry_after, "address")
+
+
+def invalidate_user(user_id: int):
+    token_cache.delete_where(lambda cached: cached[1].id == user_id)
+
+
+@sa.event.listens_for(users.User, "after_update")
+@sa.event.listens_for(users.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: users.User):
+    invalidate_user(target.id)
@@ -1,28 +1,135 @@
+import base64
+import datetime
+import time
+from typing import Annotated, Any, Literal, Optional
 
 import fastapi
+import orjson
+import pydantic
+import sqlalchemy as sa
+from fastapi import responses as fastapi_responses
 from fastapi import status as fastapi_status
 from sqlalchemy import orm as sa_orm
+from sqlalchemy.ext import asyncio as sa_asyncio
 from sqlalchemy.sql import expression
 
-from core import database, ws_manager
+from core import cache, database, metrics, outbox, scheduler, settings, versions, ws_manager
 from models import events as events_models
 from models import users as users_models
 from schemas import events as events_schemas
+from schemas import users as users_schemas
 
 from . import deps
 
 router = fastapi.APIRouter()
 
-@router.get("/", response_model=list[events_schemas.BaseEvent])
-def get_events(db: sa_orm.Session = fastapi.Depends(database.get_db)):
-    return db.query(events_models.Event).all()
+# event id -> serialized EventDetail, dropped whenever the event changes.
+event_detail_cache = cache.TTLCache(
+    maxsize=settings.EVENT_DETAIL_CACHE_SIZE, ttl=settings.EVENT_DETAIL_CACHE_TTL
+)
+metrics.register_cache(event_detail_cache, "event_detail")
+
+# Bumped by every broadcast that changes an event or the listing, see
+# bump_event_versions.
+event_versions = versions.Versions(maxsize=settings.EVENT_VERSIONS_SIZE)
+
+class RawJSONResponse(fastapi_responses.Response):
+    # Content is already serialized JSON bytes.
+    media_type = "application/json"
+
+
+def version_etag(db: sa_orm.Session, version: tuple[int, float]) -> Optional[str]:
+    # Taken before reading, so content is never older than its tag. A replica
+    # may not have seen a recent change yet though, so reads from one are only
+    # tagged once things have been quiet for a while.
+    number, changed_at = version
+    if not settings.EVENT_ETAGS:
+        return None
+    if db.info.get("replica") and time.monotonic() - changed_at < database.read_routing.sticky_seconds:
+        return None
+    return event_versions.etag(number)
+
+
+def not_modified(request: fastapi.Request, etag: Optional[str]) -> Optional[fastapi_responses.Response]:
+    if etag is not None and versions.etag_matches(request.headers.get("if-none-match"), etag):
+        return fastapi_responses.Response(status_code=fastapi_status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+
+@router.get("/", response_model=list[events_schemas.BaseEvent], response_class=RawJSONResponse)
+def get_events(
+    params: Annotated[events_schemas.EventListParams, fastapi.Query()],
+    request: fastapi.Request,
+    db: sa_orm.Session = fastapi.Depends(deps.get_read_db)
+):
+    # Any change may affect any page, so all listings share one version.
+    etag = version_etag(db, event_versions.catalogue())
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    rows = db.execute(build_events_query(params)).all()
+    headers = {"ETag": etag} if etag is not None else {}
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].date_time, rows[-1].id)
+    return RawJSONResponse(content=events_schemas.dump_base_events(rows), headers=headers)
+
+
+@router.get("/upcoming", response_model=list[events_schemas.UpcomingEvent], response_class=RawJSONResponse)
+async def get_upcoming_events(params: Annotated[events_schemas.UpcomingEventParams, fastapi.Query()]):
+    # Answered from the scheduler's in-memory index, without the database.
+    return RawJSONResponse(content=orjson.dumps([
+        {"id": event_id, "date_time": events_schemas.format_datetime(date_time)}
+        for event_id, date_time in scheduler.scheduler.upcoming(params.within, params.limit)
+    ]))
+
+
+class ClosingStreamingResponse(fastapi_responses.StreamingResponse):
+    # Close the body generator, and with it the database cursor, as soon as
+    # the response ends, including when the client disconnects mid-stream.
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+@router.get("/export", response_class=ClosingStreamingResponse)
+async def export_events(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    session_factory: sa_asyncio.async_sessionmaker = fastapi.Depends(deps.get_read_async_sessionmaker),
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return ClosingStreamingResponse(
+        stream_export(session_factory, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="events.{format}"'},
+    )
+
+
+async def stream_export(session_factory: sa_asyncio.async_sessionmaker, format: str):
+    query = expression.select(
+        *(getattr(events_models.Event, column) for column in events_schemas.EXPORT_COLUMNS)
+    ).order_by(events_models.Event.id).execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    async with session_factory() as db:
+        result = await db.stream(query)
+        first = True
+        async for rows in result.partitions():
+            if format == "csv":
+                yield events_schemas.dump_export_csv(rows, header=first)
+            else:
+                yield events_schemas.dump_export_ndjson(rows)
+            first = False
+        if first and format == "csv":
+            yield events_schemas.dump_export_csv([], header=True)
 
 
 @router.post("/create", response_model=events_schemas.BaseEvent)
 async def create_event(
     event: events_schemas.EventCreate,
-    db: sa_orm.Session = fastapi.Depends(database.get_db),
-    current_user: users_models.User = fastapi.Depends(deps.get_current_user)
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
 ):
     event = events_models.Event(
         **event.model_dump(),
@@ -30,18 +137,126 @@ async def create_event(
         is_cancelled=False
     )
     db.add(event)
-    db.commit()
-    db.refresh(event)
-    event_data = events_schemas.BaseEvent.model_validate(event).model_dump()
-    await ws_manager.manager.broadcast(
+    await db.flush()
+    message = outbox.add(
+        db,
         "event_created",
-        event_data,
+        events_schemas.BaseEvent.model_validate(event).model_dump(),
+        topics=[ws_manager.EVENTS_TOPIC],
     )
+    await db.commit()
+    outbox.committed(background_tasks, message)
     return event
 
 
-@router.get("/{event_id}", response_model=events_schemas.EventDetail)
-def get_event(event_id: int, db: sa_orm.Session = fastapi.Depends(database.get_db)):
+@router.post("/bulk", response_model=events_schemas.BulkCreateResult)
+async def bulk_create_events(
+    items: Annotated[list[dict[str, Any]], fastapi.Body(max_length=settings.BULK_MAX_ITEMS)],
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
+):
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            event = events_schemas.EventCreate.model_validate(item)
+        except pydantic.ValidationError as error:
+            errors.append({"index": index, "detail": error.errors(include_url=False, include_context=False)})
+            continue
+        rows.append({**event.model_dump(), "organizer_id": current_user.id, "is_cancelled": False})
+    created = []
+    if rows:
+        # One multi-row INSERT ... RETURNING in a single transaction.
+        result = await db.execute(
+            expression.insert(events_models.Event).returning(
+                *(getattr(events_models.Event, column) for column in events_schemas.BASE_EVENT_COLUMNS),
+                sort_by_parameter_order=True,
+            ),
+            rows,
+        )
+        created = [events_schemas.BaseEvent.model_validate(row._asdict()) for row in result]
+        message = outbox.add(
+            db,
+            "events_created",
+            {"events": [event.model_dump() for event in created]},
+            topics=[ws_manager.EVENTS_TOPIC],
+        )
+        await db.commit()
+        outbox.committed(background_tasks, message)
+    return {"created": created, "errors": errors}
+
+
+@router.post("/bulk/join", response_model=events_schemas.BatchParticipationResult)
+async def bulk_join_events(
+    batch: events_schemas.BatchParticipation,
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
+):
+    return await change_participation(batch, background_tasks, db, current_user, join=True)
+
+
+@router.post("/bulk/leave", response_model=events_schemas.BatchParticipationResult)
+async def bulk_leave_events(
+    batch: events_schemas.BatchParticipation,
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
+):
+    return await change_participation(batch, background_tasks, db, current_user, join=False)
+
+
+async def change_participation(
+    batch: events_schemas.BatchParticipation,
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession,
+    current_user: users_schemas.User,
+    join: bool,
+):
+    event_ids = list(dict.fromkeys(batch.event_ids))
+    if join:
+        succeeded, errors = await join_events(db, event_ids, current_user.id)
+    else:
+        succeeded, errors = await leave_events(db, event_ids, current_user.id)
+    if succeeded:
+        participant = {"id": current_user.id, "name": current_user.name}
+        message = outbox.add(
+            db,
+            "participants_changed",
+            {"events": [
+                {"id": event_id, "joined": [participant] if join else [], "left": [] if join else [participant]}
+                for event_id in succeeded
+            ]},
+            topics=[ws_manager.event_topic(event_id) for event_id in succeeded],
+        )
+        await db.commit()
+        outbox.committed(background_tasks, message)
+    return {
+        "succeeded": succeeded,
+        "errors": [{"event_id": event_id, "detail": detail} for event_id, detail in errors.items()],
+    }
+
+
+@router.get("/{event_id}", response_model=events_schemas.EventDetail, response_class=RawJSONResponse)
+def get_event(
+    event_id: int,
+    request: fastapi.Request,
+    db: sa_orm.Session = fastapi.Depends(deps.get_read_db),
+):
+    etag = version_etag(db, event_versions.event(event_id))
+    headers = {"ETag": etag} if etag is not None else None
+    # Readers who just wrote skip the cache, which may have been filled from a
+    # replica that had not seen their write yet.
+    content = None if db.info.get("read_your_writes") else event_detail_cache.get(event_id)
+    # Only an event known to exist is answered 304, so a missing one still
+    # gets 404 for `If-None-Match: *` or a stale tag.
+    if content is not None or event_versions.known(event_id):
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+    if content is not None:
+        return RawJSONResponse(content=content, headers=headers)
+    generation = event_detail_cache.generation
     event_query = expression.select(
         events_models.Event.id,
         events_models.Event.title,
@@ -49,6 +264,8 @@ def get_event(event_id: int, db: sa_orm.Session = fastapi.Depends(database.get_d
         events_models.Event.duration,
         events_models.Event.address,
         events_models.Event.is_cancelled,
+        events_models.Event.capacity,
+        events_models.Event.participant_count,
         users_models.User.id.label("organizer_id"),
         users_models.User.name,
     ).join(users_models.User, events_models.Event.organizer_id == users_models.User.id)\
@@ -59,6 +276,9 @@ def get_event(event_id: int, db: sa_orm.Session = fastapi.Depends(database.get_d
             status_code=fastapi_status.HTTP_404_NOT_FOUND,
             detail="Event not found"
         )
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
     participants_query = expression.select(
         users_models.User.id,
         users_models.User.name,
@@ -72,60 +292,59 @@ def get_event(event_id: int, db: sa_orm.Session = fastapi.Depends(database.get_d
         "duration": event.duration,
         "address": event.address,
         "is_cancelled": event.is_cancelled,
+        "capacity": event.capacity,
+        "participant_count": event.participant_count,
         "organizer": {
             "id": event.organizer_id,
             "name": event.name
         },
         "participants": participants
     }
-    return events_schemas.EventDetail.model_validate(event_data)
+    content = events_schemas.EventDetail.model_validate(event_data).model_dump_json().encode()
+    # Replicas may lag, so what they return is kept no longer than a writer
+    # sticks to the primary.
+    ttl = database.read_routing.sticky_seconds if db.info.get("replica") else None
+    event_detail_cache.set(event_id, content, ttl=ttl, generation=generation)
+    return RawJSONResponse(content=content, headers=headers)
 
 
 @router.post("/{event_id}/cancel")
 async def cancel_event(
     event_id: int,
-    db: sa_orm.Session = fastapi.Depends(database.get_db),
-    current_user: users_models.User = fastapi.Depends(deps.get_current_user)
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
 ):
-    event = verify_event(event_id, db)
+    event = await verify_event(event_id, db)
     if event.organizer_id != current_user.id:
         raise fastapi.HTTPException(
             status_code=fastapi_status.HTTP_403_FORBIDDEN,
             detail="You are not the organizer of this event"
         )
     event.is_cancelled = True
-    db.commit()
-    await ws_manager.manager.broadcast(
+    message = outbox.add(
+        db,
         "event_canceled",
         {"id": event_id},
+        topics=[ws_manager.EVENTS_TOPIC, ws_manager.event_topic(event_id)],
     )
+    await db.commit()
+    outbox.committed(background_tasks, message)
     return {"message": "Event cancelled successfully"}
 
 
 @router.post("/{event_id}/join")
 async def join_event(
     event_id: int,
-    db: sa_orm.Session = fastapi.Depends(database.get_db),
-    current_user: users_models.User = fastapi.Depends(deps.get_current_user)
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
 ):
-    verify_event(event_id, db)
-    exists = db.query(events_models.EventParticipant).filter(
-        events_models.EventParticipant.event_id == event_id,
-        events_models.EventParticipant.user_id == current_user.id
-    ).exists()
-    if db.query(exists).scalar():
-        raise fastapi.HTTPException(
-            status_code=fastapi_status.HTTP_400_BAD_REQUEST,
-            detail="You have already joined the event"
-        )
-    event_participant = events_models.EventParticipant(
-        event_id=event_id,
-        user_id=current_user.id
-    )
-    db.add(event_participant)
-    db.commit()
-    db.refresh(event_participant)
-    await ws_manager.manager.broadcast(
+    _, errors = await join_events(db, [event_id], current_user.id)
+    if errors:
+        raise participation_error(errors[event_id])
+    message = outbox.add(
+        db,
         "joined_event",
         {
             "id": event_id,
@@ -134,32 +353,25 @@ async def join_event(
                 "name": current_user.name
             }
         },
+        topics=[ws_manager.event_topic(event_id)],
     )
+    await db.commit()
+    outbox.committed(background_tasks, message)
     return {"message": "Joined event successfully"}
 
 
 @router.post("/{event_id}/leave")
 async def leave_event(
     event_id: int,
-    db: sa_orm.Session = fastapi.Depends(database.get_db),
-    current_user: users_models.User = fastapi.Depends(deps.get_current_user)
+    background_tasks: fastapi.BackgroundTasks,
+    db: sa_asyncio.AsyncSession = fastapi.Depends(database.get_async_db),
+    current_user: users_schemas.User = fastapi.Depends(deps.get_writing_user)
 ):
-    verify_event(event_id, db)
-    exists = db.query(events_models.EventParticipant).filter(
-        events_models.EventParticipant.event_id == event_id,
-        events_models.EventParticipant.user_id == current_user.id
-    ).exists()
-    if not db.query(exists).scalar():
-        raise fastapi.HTTPException(
-            status_code=fastapi_status.HTTP_400_BAD_REQUEST,
-            detail="You have not joined the event"
-        )
-    db.query(events_models.EventParticipant).filter(
-        events_models.EventParticipant.event_id == event_id,
-        events_models.EventParticipant.user_id == current_user.id
-    ).delete()
-    db.commit()
-    await ws_manager.manager.broadcast(
+    _, errors = await leave_events(db, [event_id], current_user.id)
+    if errors:
+        raise participation_error(errors[event_id])
+    message = outbox.add(
+        db,
         "left_event",
         {
             "id": event_id,
@@ -168,18 +380,182 @@ async def leave_event(
                 "name": current_user.name
             }
         },
+        topics=[ws_manager.event_topic(event_id)],
     )
+    await db.commit()
+    outbox.committed(background_tasks, message)
     return {"message": "Left event successfully"}
 
 
-def verify_event(event_id, db):
-    event = db.query(events_models.Event).filter(
-        events_models.Event.id == event_id,
+EVENT_NOT_FOUND = "Event not found"
+EVENT_FULL = "Event is full"
+ALREADY_JOINED = "You have already joined the event"
+NOT_JOINED = "You have not joined the event"
+
+PARTICIPATION_ERROR_STATUS = {
+    EVENT_NOT_FOUND: fastapi_status.HTTP_404_NOT_FOUND,
+    EVENT_FULL: fastapi_status.HTTP_409_CONFLICT,
+    ALREADY_JOINED: fastapi_status.HTTP_400_BAD_REQUEST,
+    NOT_JOINED: fastapi_status.HTTP_400_BAD_REQUEST,
+}
+
+
+def participation_error(detail: str) -> fastapi.HTTPException:
+    return fastapi.HTTPException(status_code=PARTICIPATION_ERROR_STATUS[detail], detail=detail)
+
+
+async def adjust_participant_counts(db: sa_asyncio.AsyncSession, event_ids: list[int], delta: int) -> set[int]:
+    # Bumps participant_count on open events (within capacity when joining)
+    # and returns the ids it updated. The UPDATE locks those rows, so the
+    # capacity check and the increment cannot race with other joins.
+    if not event_ids:
+        return set()
+    query = expression.update(events_models.Event).where(
+        events_models.Event.id.in_(event_ids),
         events_models.Event.is_cancelled == False,
-    ).first()
+    )
+    if delta > 0:
+        query = query.where(sa.or_(
+            events_models.Event.capacity.is_(None),
+            events_models.Event.participant_count + delta <= events_models.Event.capacity,
+        ))
+    query = query.values(participant_count=events_models.Event.participant_count + delta)
+    return set(await db.scalars(query.returning(events_models.Event.id)))
+
+
+async def unavailable_event_errors(db: sa_asyncio.AsyncSession, event_ids: list[int], user_id: int) -> dict[int, str]:
+    # Explains why the count UPDATE skipped these events, in one round trip.
+    if not event_ids:
+        return {}
+    joined = expression.exists().where(
+        events_models.EventParticipant.event_id == events_models.Event.id,
+        events_models.EventParticipant.user_id == user_id,
+    )
+    result = await db.execute(
+        expression.select(events_models.Event.id, joined).where(
+            events_models.Event.id.in_(event_ids),
+            events_models.Event.is_cancelled == False,
+        )
+    )
+    errors = dict.fromkeys(event_ids, EVENT_NOT_FOUND)
+    errors.update((event_id, ALREADY_JOINED if is_joined else EVENT_FULL) for event_id, is_joined in result)
+    return errors
+
+
+def sort_errors(errors: dict[int, str], event_ids: list[int]) -> dict[int, str]:
+    return {event_id: errors[event_id] for event_id in event_ids if event_id in errors}
+
+
+async def join_events(db: sa_asyncio.AsyncSession, event_ids: list[int], user_id: int) -> tuple[list[int], dict[int, str]]:
+    counted = await adjust_participant_counts(db, event_ids, 1)
+    inserted = set()
+    if counted:
+        insert = database.insert_or_ignore(db.get_bind().dialect.name, events_models.EventParticipant)
+        inserted = set(await db.scalars(
+            insert.returning(events_models.EventParticipant.event_id),
+            [{"event_id": event_id, "user_id": user_id} for event_id in counted],
+        ))
+    already_joined = [event_id for event_id in event_ids if event_id in counted and event_id not in inserted]
+    await adjust_participant_counts(db, already_joined, -1)
+    errors = await unavailable_event_errors(db, [event_id for event_id in event_ids if event_id not in counted], user_id)
+    errors.update((event_id, ALREADY_JOINED) for event_id in already_joined)
+    return [event_id for event_id in event_ids if event_id in inserted], sort_errors(errors, event_ids)
+
+
+async def leave_events(db: sa_asyncio.AsyncSession, event_ids: list[int], user_id: int) -> tuple[list[int], dict[int, str]]:
+    counted = await adjust_participant_counts(db, event_ids, -1)
+    deleted = set()
+    if counted:
+        deleted = set(await db.scalars(
+            expression.delete(events_models.EventParticipant).where(
+                events_models.EventParticipant.event_id.in_(counted),
+                events_models.EventParticipant.user_id == user_id,
+            ).returning(events_models.EventParticipant.event_id)
+        ))
+    not_joined = [event_id for event_id in event_ids if event_id in counted and event_id not in deleted]
+    await adjust_participant_counts(db, not_joined, 1)
+    errors = {event_id: EVENT_NOT_FOUND for event_id in event_ids if event_id not in counted}
+    errors.update((event_id, NOT_JOINED) for event_id in not_joined)
+    return [event_id for event_id in event_ids if event_id in deleted], sort_errors(errors, event_ids)
+
+
+def invalidate_event_detail(message: dict):
+    if message["type"] in ("joined_event", "left_event", "event_canceled"):
+        event_detail_cache.delete(message["data"]["id"])
+    elif message["type"] == "participants_changed":
+        for event in message["data"]["events"]:
+            event_detail_cache.delete(event["id"])
+
+ws_manager.manager.add_listener(invalidate_event_detail)
+
+
+def bump_event_versions(message: dict):
+    data = message["data"]
+    if message["type"] in ("event_created", "event_canceled", "joined_event", "left_event"):
+        event_versions.bump([data["id"]])
+    elif message["type"] in ("events_created", "participants_changed"):
+        event_versions.bump(event["id"] for event in data["events"])
+
+ws_manager.manager.add_listener(bump_event_versions)
+
+
+@sa.event.listens_for(users_models.User, "after_update")
+def invalidate_event_details_of_user(mapper, connection, target: users_models.User):
+    # Organizer and participant names are embedded in cached details; other
+    # updates, such as rehashing a password on login, leave them valid.
+    if not sa.inspect(target).attrs.name.history.has_changes():
+        return
+    event_detail_cache.clear()
+    event_versions.bump_all()
+
+
+async def verify_event(event_id, db):
+    event = await db.scalar(
+        expression.select(events_models.Event).where(
+            events_models.Event.id == event_id,
+            events_models.Event.is_cancelled == False,
+        )
+    )
     if not event:
         raise fastapi.HTTPException(
             status_code=fastapi_status.HTTP_404_NOT_FOUND,
             detail="Event not found"
         )
     return event
+
+
+
+def build_events_query(params: events_schemas.EventListParams):
+    query = expression.select(
+        *(getattr(events_models.Event, column) for column in events_schemas.BASE_EVENT_COLUMNS)
+    )
+    if params.cursor is not None:
+        date_time, event_id = decode_cursor(params.cursor)
+        query = query.where(
+            sa.tuple_(events_models.Event.date_time, events_models.Event.id) > sa.tuple_(date_time, event_id)
+        )
+    if params.date_from is not None:
+        query = query.where(events_models.Event.date_time >= params.date_from)
+    if params.date_to is not None:
+        query = query.where(events_models.Event.date_time < params.date_to)
+    if params.is_cancelled is not None:
+        query = query.where(events_models.Event.is_cancelled == params.is_cancelled)
+    if params.organizer_id is not None:
+        query = query.where(events_models.Event.organizer_id == params.organizer_id)
+    # One extra row tells whether there is a next page.
+    return query.order_by(events_models.Event.date_time, events_models.Event.id).limit(params.limit + 1)
+
+
+def encode_cursor(date_time: datetime.datetime, event_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{date_time.isoformat()}|{event_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        date_time, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(date_time), int(event_id)
+    except ValueError:
+        raise fastapi.HTTPException(
+            status_code=fastapi_status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
@@ -0,0 +1,10 @@
+import fastapi
+from fastapi import responses as fastapi_responses
+
+from core import metrics
+
+router = fastapi.APIRouter()
+
+@router.get("/metrics", response_class=fastapi_responses.PlainTextResponse)
+def get_metrics():
+    return fastapi_responses.PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,16 +1,71 @@
+from typing import Literal, Optional
+
 import fastapi
+import pydantic
+from fastapi import status as fastapi_status
 
-from core import ws_manager
+from core import security, ws_encoding, ws_manager
+from schemas import websocket as websocket_schemas
 
 router = fastapi.APIRouter()
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: fastapi.WebSocket):
-    await ws_manager.manager.connect(websocket)
+async def websocket_endpoint(
+    websocket: fastapi.WebSocket,
+    topics: Optional[str] = None,
+    last_seq: Optional[int] = None,
+    epoch: Optional[str] = None,
+    encoding: Literal[ws_encoding.ENCODINGS] = ws_encoding.JSON,
+    compression: Optional[Literal[ws_encoding.COMPRESSIONS]] = None,
+    token: Optional[str] = None,
+):
+    # Reconnecting clients pass the last seq/epoch they saw (and their topics)
+    # to be sent the messages they missed.
+    try:
+        initial_topics = None if topics is None else [
+            ws_manager.validate_topic(topic) for topic in topics.split(",") if topic
+        ]
+    except ValueError:
+        await websocket.close(code=fastapi_status.WS_1008_POLICY_VIOLATION)
+        return
+    # Connection limits apply per user when a token is given, else per address.
+    if token is not None:
+        user_id = security.verify_token(token)
+        if user_id is None:
+            await websocket.close(code=fastapi_status.WS_1008_POLICY_VIOLATION)
+            return
+        user_key = f"user:{user_id}"
+    else:
+        user_key = f"{ws_manager.ADDRESS_KEY_PREFIX}{websocket.client.host}" if websocket.client else None
+    if not await ws_manager.manager.connect(
+        websocket, initial_topics, last_seq, epoch, ws_encoding.Format(encoding, compression), user_key
+    ):
+        return
     try:
         while True:
             data = await websocket.receive_text()
+            ws_manager.manager.touch(websocket)
+            if data == "pong":
+                continue
             if data == "ping":
-                await websocket.send_text("pong")
+                await ws_manager.manager.send_personal_message("pong", websocket)
+            else:
+                await handle_command(websocket, data)
     except fastapi.websockets.WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.manager.disconnect(websocket)
+
+
+async def handle_command(websocket: fastapi.WebSocket, data: str):
+    try:
+        command = websocket_schemas.SubscriptionCommand.model_validate_json(data)
+    except pydantic.ValidationError as error:
+        reply = {"type": "error", "data": {"detail": error.errors(include_url=False, include_context=False)}}
+    else:
+        if command.action == "subscribe":
+            topics = ws_manager.manager.subscribe(websocket, command.all_topics())
+        else:
+            topics = ws_manager.manager.unsubscribe(websocket, command.all_topics())
+        reply = {"type": f"{command.action}d", "data": {"topics": sorted(topics)}}
+    await ws_manager.manager.send_personal_message(reply, websocket)
@@ -0,0 +1,83 @@
+"""Cross-worker broadcast delivery latency over the Unix socket backend.
+
+Run from the project directory:
+
+    python -m benchmarks.bus_latency --workers 4 --messages 5000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import tempfile
+
+from core import pubsub
+
+
+async def receive(directory: str, expected: int, ready, results) -> None:
+    received = 0
+    done = asyncio.Event()
+
+    def deliver(message: dict) -> None:
+        nonlocal received
+        received += 1
+        if received == expected:
+            done.set()
+
+    backend = pubsub.UnixSocketBackend(directory=directory)
+    await backend.start(deliver)
+    ready.release()
+    try:
+        await asyncio.wait_for(done.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        pass
+    await backend.stop()
+    results.put(backend.stats())
+
+
+async def publish(directory: str, messages: int, rate: int) -> dict:
+    backend = pubsub.UnixSocketBackend(directory=directory)
+    await backend.start(lambda message: None)
+    participant = {"id": 1, "name": "Benchmark User"}
+    for index in range(messages):
+        await backend.publish({
+            "type": "joined_event",
+            "data": {"id": index, "participant": participant},
+            "topics": [f"event:{index}"],
+        })
+        await asyncio.sleep(1 / rate)
+    await backend.stop()
+    return backend.stats()
+
+
+def run_receiver(directory, expected, ready, results):
+    asyncio.run(receive(directory, expected, ready, results))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rate", type=int, default=2000, help="messages per second")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ready = multiprocessing.Semaphore(0)
+        results = multiprocessing.Queue()
+        receivers = [
+            multiprocessing.Process(target=run_receiver, args=(directory, args.messages, ready, results))
+            for _ in range(args.workers)
+        ]
+        for process in receivers:
+            process.start()
+        for _ in receivers:
+            ready.acquire()
+        publisher = asyncio.run(publish(directory, args.messages, args.rate))
+        workers = [results.get() for _ in receivers]
+        for process in receivers:
+            process.join()
+
+    print(json.dumps({"publisher": publisher, "workers": workers}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Event listing serialization: ORM + BaseEvent vs. plain rows + orjson.
+
+Run from the project directory:
+
+    python -m benchmarks.list_serialization --rows 100000
+"""
+import argparse
+import datetime
+import json
+import time
+
+import pydantic
+import sqlalchemy
+from sqlalchemy import orm as sa_orm
+from sqlalchemy.sql import expression
+
+from core import database
+from models import events as events_models
+from models import users as users_models
+from schemas import events as events_schemas
+
+
+def populate(engine, rows: int) -> None:
+    database.Base.metadata.create_all(bind=engine)
+    start = datetime.datetime(2024, 1, 1, 9)
+    with engine.begin() as connection:
+        connection.execute(
+            expression.insert(users_models.User),
+            [{"id": 1, "username": "benchmark", "password": "", "name": "Benchmark"}],
+        )
+        connection.execute(
+            expression.insert(events_models.Event),
+            [
+                {
+                    "title": f"Event {index}",
+                    "organizer_id": 1,
+                    "date_time": start + datetime.timedelta(minutes=index),
+                    "duration": datetime.timedelta(minutes=15 * (index % 12 + 1)),
+                    "address": f"Room {index % 50}",
+                    "is_cancelled": index % 10 == 0,
+                }
+                for index in range(rows)
+            ],
+        )
+
+
+def orm_path(session: sa_orm.Session) -> bytes:
+    # What GET /events/ did before: ORM objects, from_attributes validation,
+    # Python field serializers, then FastAPI's JSONResponse rendering.
+    events = session.scalars(expression.select(events_models.Event)).all()
+    adapter = pydantic.TypeAdapter(list[events_schemas.BaseEvent])
+    content = adapter.dump_python(
+        [events_schemas.BaseEvent.model_validate(event) for event in events], mode="json"
+    )
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_path(session: sa_orm.Session) -> bytes:
+    columns = (getattr(events_models.Event, column) for column in events_schemas.BASE_EVENT_COLUMNS)
+    return events_schemas.dump_base_events(session.execute(expression.select(*columns)))
+
+
+def measure(function, session_factory, repeat: int) -> tuple[float, bytes]:
+    best = float("inf")
+    for _ in range(repeat):
+        with session_factory() as session:
+            started = time.perf_counter()
+            output = function(session)
+            best = min(best, time.perf_counter() - started)
+    return best, output
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    populate(engine, args.rows)
+    session_factory = sa_orm.sessionmaker(bind=engine)
+
+    orm_seconds, orm_output = measure(orm_path, session_factory, args.repeat)
+    fast_seconds, fast_output = measure(fast_path, session_factory, args.repeat)
+    assert orm_output == fast_output, "fast path output differs from BaseEvent"
+
+    print(json.dumps({
+        "rows": args.rows,
+        "orm_seconds": orm_seconds,
+        "fast_seconds": fast_seconds,
+        "speedup": orm_seconds / fast_seconds,
+        "bytes": len(fast_output),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
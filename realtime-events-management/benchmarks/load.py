@@ -0,0 +1,295 @@
+"""Load and latency benchmark against a real server process.
+
+Run from the project directory:
+
+    python -m benchmarks.load --clients 200 --concurrency 16 --duration 20 --output results.json
+    python -m benchmarks.load --baseline results.json
+
+Starts uvicorn on a temporary SQLite database, opens --clients WebSocket
+connections subscribed to everything and drives a weighted mix of create,
+join, leave, detail and list requests. Reports requests per second, HTTP
+latency percentiles per operation, broadcast latency (request sent to frame
+received by each client, so it includes the commit), server memory per
+open connection and how many sockets a connection limit refused. With
+--baseline the JSON of an earlier run is printed next to the new numbers.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+OPERATIONS = ("create", "join", "leave", "detail", "list")
+DEFAULT_MIX = "create=1,join=3,leave=2,detail=6,list=4"
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = int(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Server:
+    def __init__(self, directory: str) -> None:
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{directory}/benchmark.sqlite3",
+            "ASYNC_DATABASE_URL": "",
+            "DATABASE_SCHEMA": "create",
+            # Every client connects from one address, in a burst.
+            "RATE_LIMIT_ADDRESS_RATE": "0",
+            "WS_ACCEPT_RATE": "0",
+        }
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port), "--log-level", "warning"],
+            env=env,
+            # Own process group, so stopping it also stops its hashing workers.
+            start_new_session=True,
+        )
+
+    async def wait_ready(self, client, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{self.url}/events/", params={"limit": 1})
+                return
+            except Exception:
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Server did not start")
+
+    def stop(self) -> None:
+        os.killpg(self.process.pid, signal.SIGTERM)
+        self.process.wait(timeout=10)
+
+
+class Load:
+    def __init__(self, client, server: Server, users: list[dict], events: list[int]) -> None:
+        self.client = client
+        self.server = server
+        self.users = users
+        self.events = events
+        self.joined: dict[int, set[int]] = collections.defaultdict(set)
+        self.latencies: dict[str, list[float]] = collections.defaultdict(list)
+        self.statuses: collections.Counter = collections.Counter()
+        # (type, title) or (type, event id, user id) -> when the request
+        # that broadcasts it was sent
+        self.pending: dict[tuple, float] = {}
+        self.broadcast_latencies: list[float] = []
+
+    async def request(self, operation: str, method: str, path: str, user=None, **kwargs):
+        headers = {"Authorization": f"Bearer {user['token']}"} if user else {}
+        started = time.perf_counter()
+        response = await self.client.request(method, f"{self.server.url}{path}", headers=headers, **kwargs)
+        self.latencies[operation].append(time.perf_counter() - started)
+        self.statuses[f"{operation} {response.status_code}"] += 1
+        return response
+
+    async def create(self):
+        user = random.choice(self.users)
+        title = f"Load {random.getrandbits(48):x}"
+        self.pending[("event_created", title)] = time.perf_counter()
+        response = await self.request("create", "POST", "/events/create", user, json={
+            "title": title,
+            "date_time": (datetime.datetime(2030, 1, 1) + datetime.timedelta(minutes=random.randrange(100_000))).strftime("%Y-%m-%d %H:%M:%S"),
+            "duration": 60,
+            "address": "Benchmark Hall",
+        })
+        if response.status_code == 200:
+            self.events.append(response.json()["id"])
+
+    async def join(self):
+        user = random.choice(self.users)
+        event_id = random.choice(self.events)
+        if event_id in self.joined[user["id"]]:
+            return await self.leave(user, event_id)
+        self.joined[user["id"]].add(event_id)
+        self.pending[("joined_event", event_id, user["id"])] = time.perf_counter()
+        await self.request("join", "POST", f"/events/{event_id}/join", user)
+
+    async def leave(self, user=None, event_id=None):
+        user = user or random.choice(self.users)
+        if event_id is None:
+            if not self.joined[user["id"]]:
+                return await self.join()
+            event_id = random.choice(list(self.joined[user["id"]]))
+        self.joined[user["id"]].discard(event_id)
+        self.pending[("left_event", event_id, user["id"])] = time.perf_counter()
+        await self.request("leave", "POST", f"/events/{event_id}/leave", user)
+
+    async def detail(self):
+        await self.request("detail", "GET", f"/events/{random.choice(self.events)}")
+
+    async def list(self):
+        await self.request("list", "GET", "/events/", params={"limit": 50})
+
+    def received(self, frame: str) -> None:
+        now = time.perf_counter()
+        message = json.loads(frame)
+        data = message.get("data", {})
+        if message.get("type") == "event_created":
+            key = ("event_created", data.get("title"))
+        elif message.get("type") in ("joined_event", "left_event"):
+            key = (message["type"], data.get("id"), data.get("participant", {}).get("id"))
+        else:
+            return
+        started = self.pending.get(key)
+        if started is not None:
+            self.broadcast_latencies.append(now - started)
+
+
+async def listen(websocket, load: Load) -> None:
+    try:
+        async for frame in websocket:
+            load.received(frame)
+    except Exception:
+        pass
+
+
+async def run(args) -> dict:
+    import httpx
+    import websockets
+
+    weights = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as directory:
+        server = Server(directory)
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+                await server.wait_ready(client)
+                users = []
+                for index in range(args.users):
+                    credentials = {"username": f"load{index}", "password": "load-password"}
+                    registered = await client.post(f"{server.url}/auth/register", json={**credentials, "name": f"Load {index}"})
+                    token = (await client.post(f"{server.url}/auth/token", data=credentials)).json()["access_token"]
+                    users.append({"id": registered.json()["id"], "token": token})
+                load = Load(client, server, users, [])
+                for _ in range(args.events):
+                    await load.create()
+                load.latencies.clear()
+                load.statuses.clear()
+                load.pending.clear()
+
+                rss_before = rss_bytes(server.process.pid)
+                ws_url = server.url.replace("http", "ws", 1) + "/ws"
+                websockets_ = [await websockets.connect(ws_url, max_size=None) for _ in range(args.clients)]
+                await asyncio.sleep(0.5)
+                rss_after = rss_bytes(server.process.pid)
+                # Sockets over a connection limit are closed right away.
+                refused = sum(websocket.close_code is not None for websocket in websockets_)
+                listeners = [asyncio.create_task(listen(websocket, load)) for websocket in websockets_]
+
+                operations = [getattr(load, name) for name in weights]
+                deadline = time.perf_counter() + args.duration
+
+                async def worker():
+                    while time.perf_counter() < deadline:
+                        await random.choices(operations, weights=list(weights.values()))[0]()
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - started
+                await asyncio.sleep(1)  # let the last broadcasts arrive
+
+                for websocket in websockets_:
+                    await websocket.close()
+                for listener in listeners:
+                    listener.cancel()
+        finally:
+            server.stop()
+
+    requests = sum(len(samples) for samples in load.latencies.values())
+    memory_per_connection = None
+    if rss_before is not None and rss_after is not None and args.clients > refused:
+        memory_per_connection = (rss_after - rss_before) / (args.clients - refused)
+    return {
+        "revision": git_revision(),
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": vars(args) | {"mix": weights},
+        "requests_per_second": requests / elapsed,
+        "http_latency": {
+            "all": percentiles([sample for samples in load.latencies.values() for sample in samples]),
+            **{operation: percentiles(samples) for operation, samples in load.latencies.items()},
+        },
+        "statuses": dict(sorted(load.statuses.items())),
+        "broadcast_latency": percentiles(load.broadcast_latencies),
+        "clients_refused": refused,
+        "memory_per_connection_bytes": memory_per_connection,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100, help="open WebSocket connections")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP request loops")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--events", type=int, default=50, help="events created before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    baseline_path, output_path = args.baseline, args.output
+    del args.baseline, args.output
+    results = asyncio.run(run(args))
+    if output_path:
+        with open(output_path, "w") as output:
+            json.dump(results, output, indent=2)
+    if baseline_path:
+        with open(baseline_path) as baseline:
+            results = {"baseline": json.load(baseline), "current": results}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
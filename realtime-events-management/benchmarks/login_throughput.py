@@ -0,0 +1,96 @@
+"""Logins per second with password hashing inline vs. on the process pool.
+
+Run from the project directory:
+
+    python -m benchmarks.login_throughput --concurrency 16 --duration 10
+
+Each mode runs in a fresh interpreter against a temporary SQLite database.
+"Inline" (PASSWORD_HASH_WORKERS=0) hashes on the shared threadpool like the
+old synchronous endpoints did. While logins run, a probe measures the latency
+of GET /events/ to show how much the login burst starves other requests.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def run_mode(concurrency: int, duration: float) -> dict:
+    import httpx
+
+    from core import database
+    from main import app
+
+    database.Base.metadata.create_all(bind=database.engine)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        credentials = {"username": "benchmark", "password": "benchmark-password"}
+        await client.post("/auth/register", json={**credentials, "name": "Benchmark"})
+        await client.post("/auth/token", data=credentials)  # warm up the pool
+
+        logins = 0
+        probe_latencies = []
+        deadline = time.perf_counter() + duration
+
+        async def login_loop():
+            nonlocal logins
+            while time.perf_counter() < deadline:
+                response = await client.post("/auth/token", data=credentials)
+                response.raise_for_status()
+                logins += 1
+
+        async def probe_loop():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.get("/events/", params={"limit": 1})
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        await asyncio.gather(probe_loop(), *(login_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    probe_latencies.sort()
+    return {
+        "logins_per_second": logins / elapsed,
+        "probe_p50_ms": statistics.median(probe_latencies) * 1000,
+        "probe_max_ms": probe_latencies[-1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_mode(args.concurrency, args.duration))))
+        return
+
+    results = {}
+    for mode, workers in (("inline", 0), ("process_pool", args.workers)):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{directory}/benchmark.sqlite3",
+                "PASSWORD_HASH_WORKERS": str(workers),
+            }
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.login_throughput", "--child",
+                 "--concurrency", str(args.concurrency), "--duration", str(args.duration)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results[mode] = {"workers": workers, **json.loads(output.splitlines()[-1])}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
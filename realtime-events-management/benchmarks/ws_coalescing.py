@@ -0,0 +1,86 @@
+"""Frames and CPU for a join storm, with and without broadcast coalescing.
+
+Run from the project directory:
+
+    python -m benchmarks.ws_coalescing --clients 1000 --joins 5000 --window-ms 20
+
+Sockets are in-memory stand-ins, so this measures the manager's own cost:
+encoding, queueing and per-socket writes.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from core import ws_manager
+
+
+class NullWebSocket:
+    def __init__(self) -> None:
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def storm(clients: int, joins: int, events: int, rate: int, window_ms: int) -> dict:
+    manager = ws_manager.ConnectionManager(
+        max_queue_size=joins + 1,
+        coalesce_window=window_ms / 1000,
+        coalesce_max_messages=1000,
+    )
+    websockets = [NullWebSocket() for _ in range(clients)]
+    for websocket in websockets:
+        await manager.connect(websocket)
+
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    for index in range(joins):
+        event_id = index % events
+        await manager.broadcast(
+            "joined_event",
+            {"id": event_id, "participant": {"id": index, "name": f"User {index}"}},
+            topics=[ws_manager.event_topic(event_id)],
+        )
+        if index % 100 == 99:
+            await asyncio.sleep(100 / rate)
+    await manager.flush()
+    while any(connection.queue for connection in manager.active_connections.values()):
+        await asyncio.sleep(0.001)
+    wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+
+    frames = sum(websocket.frames for websocket in websockets)
+    await manager.stop()
+    return {
+        "window_ms": window_ms,
+        "frames_sent": frames,
+        "frames_per_second": frames / wall,
+        "joins_per_second": joins / wall,
+        "cpu_seconds": cpu,
+        "wall_seconds": wall,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--joins", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=1, help="distinct events receiving joins")
+    parser.add_argument("--rate", type=int, default=5000, help="joins per second")
+    parser.add_argument("--window-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(storm(args.clients, args.joins, args.events, args.rate, window_ms))
+        for window_ms in (0, args.window_ms)
+    ]
+    print(json.dumps({"without_coalescing": results[0], "with_coalescing": results[1]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Bytes on the wire and CPU per broadcast for each WebSocket format.
+
+Run from the project directory:
+
+    python -m benchmarks.ws_encoding --clients 1000 --messages 2000
+
+Every format is encoded once per broadcast and shared by all sockets. For
+comparison, "json+permessage-deflate" compresses per socket with context
+takeover, which is what the server's protocol-level extension does.
+"""
+import argparse
+import json
+import time
+import zlib
+
+from core import settings, ws_encoding
+
+
+def sample_messages(count: int) -> list[dict]:
+    messages = []
+    for index in range(count):
+        participant = {"id": index, "name": f"User {index}"}
+        if index % 10 == 0:
+            type, data = "participants_changed", {"events": [{
+                "id": index % 50,
+                "joined": [{"id": user_id, "name": f"User {user_id}"} for user_id in range(index, index + 20)],
+                "left": [],
+            }]}
+        elif index % 10 == 1:
+            type, data = "event_created", {
+                "id": index, "title": f"Event {index}", "date_time": "2024-10-27 13:00:00",
+                "duration": "1 hours", "address": "Main Street 1", "is_cancelled": False,
+                "capacity": None, "participant_count": 0,
+            }
+        else:
+            type, data = "joined_event", {"id": index % 50, "participant": participant}
+        messages.append({"type": type, "data": data, "seq": index + 1, "epoch": "3f9c2a1b7d04"})
+    return messages
+
+
+def measure_shared(messages: list[dict], format: ws_encoding.Format, clients: int) -> dict:
+    started = time.process_time()
+    total = 0
+    for payload in messages:
+        frame = ws_encoding.Frame(payload)
+        for _ in range(clients):
+            total += len(frame.encode(format))
+    cpu = time.process_time() - started
+    return {"bytes_per_message": total / clients / len(messages), "cpu_us_per_broadcast": cpu / len(messages) * 1e6}
+
+
+def measure_per_socket_deflate(messages: list[dict], clients: int) -> dict:
+    compressors = [
+        zlib.compressobj(settings.WS_DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS) for _ in range(clients)
+    ]
+    started = time.process_time()
+    total = 0
+    for payload in messages:
+        data = ws_encoding.Frame(payload).encode().encode()
+        for compressor in compressors:
+            total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    cpu = time.process_time() - started
+    return {"bytes_per_message": total / clients / len(messages), "cpu_us_per_broadcast": cpu / len(messages) * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    messages = sample_messages(args.messages)
+    results = {}
+    for encoding in ws_encoding.ENCODINGS:
+        for compression in (None, *ws_encoding.COMPRESSIONS):
+            name = encoding if compression is None else f"{encoding}+{compression}"
+            results[name] = measure_shared(messages, ws_encoding.Format(encoding, compression), args.clients)
+    results["json+permessage-deflate"] = measure_per_socket_deflate(messages, args.clients)
+    print(json.dumps({"clients": args.clients, "messages": args.messages, "formats": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
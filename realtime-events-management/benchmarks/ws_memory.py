@@ -0,0 +1,64 @@
+"""Python memory held per WebSocket connection by the connection manager.
+
+Run from the project directory:
+
+    python -m benchmarks.ws_memory --clients 10000
+
+Counts what the manager allocates for each socket (connection state, writer
+task, subscriptions, heartbeat bookkeeping) with tracemalloc, idle and with a
+few frames queued. Server and protocol buffers come on top; measure the whole
+process with `python -m benchmarks.load`.
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+
+from core import ws_manager
+
+
+class StalledWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def measure(clients: int, queued: int) -> dict:
+    manager = ws_manager.ConnectionManager(heartbeat_interval=3600, max_connections=0)
+    await manager.start()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(clients):
+        await manager.connect(StalledWebSocket(), topics=[ws_manager.event_topic(index % 100)], user_key=f"user:{index}")
+    await asyncio.sleep(0)
+    idle = tracemalloc.get_traced_memory()[0]
+    for event_id in range(queued):
+        await manager.broadcast("event_created", {"id": event_id, "title": f"Event {event_id}"})
+    await asyncio.sleep(0)
+    busy = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stats = manager.stats()
+    await manager.stop()
+    return {
+        "clients": clients,
+        "idle_bytes_per_connection": (idle - before) / clients,
+        f"bytes_per_connection_with_{queued}_queued": (busy - before) / clients,
+        "manager_stats": stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--queued", type=int, default=10, help="broadcasts left in every send queue")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(measure(args.clients, args.queued)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,221 @@
+import itertools
+import logging
+from typing import Iterable, Optional
+
 import sqlalchemy
+from sqlalchemy.dialects import postgresql as sa_postgresql
+from sqlalchemy.dialects import sqlite as sa_sqlite
+from sqlalchemy.ext import asyncio as sa_asyncio
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
+from . import cache
 from . import settings
 
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_url(url: str) -> str:
+    parsed = sqlalchemy.make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+
 engine = sqlalchemy.create_engine(settings.DATABASE_URL, echo=settings.DEVELOPMENT)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = sa_asyncio.create_async_engine(
+    settings.ASYNC_DATABASE_URL or get_async_url(settings.DATABASE_URL),
+    echo=settings.DEVELOPMENT,
+)
+AsyncSessionLocal = sa_asyncio.async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+# Read replicas, e.g. separate SQLite files locally. Only reads that may lag
+# behind the primary go there, through the read session dependencies.
+read_engines = [
+    sqlalchemy.create_engine(url, echo=settings.DEVELOPMENT, logging_name=f"replica{index}")
+    for index, url in enumerate(settings.DATABASE_READ_URLS, 1)
+]
+async_read_engines = [
+    sa_asyncio.create_async_engine(get_async_url(url), echo=settings.DEVELOPMENT, logging_name=f"replica{index}")
+    for index, url in enumerate(settings.DATABASE_READ_URLS, 1)
+]
+
+
+class ReadRouting:
+    # Spreads read-only sessions over the replicas round-robin, except for
+    # users who wrote in the last `sticky_seconds`: their reads go to the
+    # primary so they see their own changes. Sessions have info["replica"] or
+    # info["read_your_writes"] set accordingly, e.g. for caches to honour.
+    def __init__(
+        self,
+        primary: sessionmaker,
+        async_primary: sa_asyncio.async_sessionmaker,
+        replicas: Iterable[sessionmaker] = (),
+        async_replicas: Iterable[sa_asyncio.async_sessionmaker] = (),
+        sticky_seconds: float = settings.DATABASE_READ_STICKY_SECONDS,
+        maxsize: int = settings.DATABASE_READ_STICKY_USERS,
+    ) -> None:
+        self.primary = primary
+        self.async_primary = async_primary
+        self.replicas = list(replicas)
+        self.async_replicas = list(async_replicas)
+        self.sticky_seconds = sticky_seconds
+        # user id -> True while their reads stick to the primary
+        self.recent_writers = cache.TTLCache(maxsize=maxsize, ttl=sticky_seconds)
+        self._turn = itertools.count()
+
+    def wrote(self, user_id: int):
+        if self.replicas or self.async_replicas:
+            self.recent_writers.set(user_id, True)
+
+    def sticks(self, user_id: Optional[int]) -> bool:
+        return user_id is not None and bool(self.recent_writers.get(user_id))
+
+    def session(self, user_id: Optional[int] = None) -> Session:
+        if not self.replicas:
+            return self.primary()
+        if self.sticks(user_id):
+            session = self.primary()
+            session.info["read_your_writes"] = True
+            return session
+        return self.replicas[next(self._turn) % len(self.replicas)]()
+
+    def async_sessionmaker(self, user_id: Optional[int] = None) -> sa_asyncio.async_sessionmaker:
+        if not self.async_replicas or self.sticks(user_id):
+            return self.async_primary
+        return self.async_replicas[next(self._turn) % len(self.async_replicas)]
+
+
+read_routing = ReadRouting(
+    SessionLocal,
+    AsyncSessionLocal,
+    [
+        sessionmaker(autocommit=False, autoflush=False, bind=read_engine, info={"replica": True})
+        for read_engine in read_engines
+    ],
+    [
+        sa_asyncio.async_sessionmaker(
+            bind=read_engine, autoflush=False, expire_on_commit=False, info={"replica": True}
+        )
+        for read_engine in async_read_engines
+    ],
+)
+
 class Base(DeclarativeBase):
     pass
 
+def insert_or_ignore(dialect_name: str, table):
+    # INSERT that silently skips rows violating a unique constraint.
+    if dialect_name == "postgresql":
+        return sa_postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sa_sqlite.insert(table).on_conflict_do_nothing()
+    # Joins and leaves also need RETURNING, which rules out MySQL.
+    raise NotImplementedError(f"Unsupported database: {dialect_name}")
+
+SCHEMA_ACTIONS = ("create", "verify", "skip")
+
+
+def missing_schema(connection: sqlalchemy.Connection) -> list[str]:
+    inspector = sqlalchemy.inspect(connection)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in columns)
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index.name for index in table.indexes if index.name not in indexes)
+    return missing
+
+
+# Fill columns that "create" added to existing tables from the data already
+# there, so it reads as if the column had always been maintained.
+BACKFILLS = {
+    "events.participant_count": (
+        "UPDATE events SET participant_count = "
+        "(SELECT COUNT(*) FROM event_participants WHERE event_participants.event_id = events.id)"
+    ),
+}
+
+
+def add_missing_columns(connection: sqlalchemy.Connection) -> list[str]:
+    # Only works for columns that are nullable or have a server default.
+    inspector = sqlalchemy.inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = sqlalchemy.schema.CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+    for name in added:
+        if name in BACKFILLS:
+            connection.execute(sqlalchemy.text(BACKFILLS[name]))
+    return added
+
+
+def add_missing_indexes(connection: sqlalchemy.Connection) -> list[str]:
+    # create_all only indexes the tables it creates.
+    inspector = sqlalchemy.inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+                added.append(index.name)
+    return added
+
+
+def prepare_schema(action: str = settings.DATABASE_SCHEMA):
+    # "create" adds missing tables, columns and indexes; "verify" only checks.
+    if action not in SCHEMA_ACTIONS:
+        raise ValueError(f"Unknown schema action: {action}")
+    if action == "create":
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            added = add_missing_columns(connection)
+            added_indexes = add_missing_indexes(connection)
+        if added:
+            logger.warning("Added missing columns: %s", ", ".join(added))
+        if added_indexes:
+            logger.warning("Added missing indexes: %s", ", ".join(added_indexes))
+    if action != "skip":
+        with engine.connect() as connection:
+            missing = missing_schema(connection)
+        if missing:
+            raise RuntimeError(f"Database schema is missing: {', '.join(missing)}")
+
+
+async def prewarm_pools(size: int = settings.DATABASE_POOL_PREWARM):
+    # Opens connections up front so the first requests don't pay for it.
+    async_connections = [await async_engine.connect() for _ in range(size)]
+    sync_connections = [engine.connect() for _ in range(size)]
+    for connection in sync_connections:
+        connection.close()
+    for connection in async_connections:
+        await connection.close()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,89 @@
+import collections
+from typing import Hashable, NamedTuple, Optional
+
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.sql import expression
+
+from core import ws_encoding
+from models import broadcasts as broadcasts_models
+
+# Epoch shared by every worker when sequence numbers come from the database.
+PERSISTENT_EPOCH = "db"
+
+
+class Entry(NamedTuple):
+    seq: int
+    topics: Optional[list[str]]
+    key: Optional[Hashable]
+    frame: ws_encoding.Frame
+
+
+# Ring buffer of the most recent frames so a reconnecting client can be sent
+# what it missed. Sequence numbers only mean something within one epoch.
+class EventLog:
+    def __init__(self, maxsize: int, epoch: str) -> None:
+        self.maxsize = maxsize
+        self.epoch = epoch
+        self.entries: collections.deque[Entry] = collections.deque()
+        self.last_seq = 0
+        # Highest sequence number that is no longer retained.
+        self.floor = 0
+
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, entry: Entry) -> None:
+        self.last_seq = max(self.last_seq, entry.seq)
+        self.entries.append(entry)
+        if len(self.entries) > self.maxsize:
+            self.floor = max(self.floor, self.entries.popleft().seq)
+
+    def since(self, seq: int, limit: int) -> Optional[list[Entry]]:
+        # None means the gap can't be filled from memory.
+        if seq < self.floor or seq > self.last_seq:
+            return None
+        # Messages relayed from other workers may arrive slightly out of order.
+        missed = sorted(entry for entry in self.entries if entry.seq > seq)
+        return missed if len(missed) <= limit else None
+
+
+# Persists broadcasts so sequence numbers are shared by all workers and
+# survive restarts. Only the most recent `retention` rows are kept.
+class DatabaseEventStore:
+    def __init__(self, session_factory: sa_asyncio.async_sessionmaker, retention: int) -> None:
+        self.session_factory = session_factory
+        self.retention = retention
+
+    async def append(self, message: dict) -> int:
+        async with self.session_factory() as db:
+            seq = await db.scalar(
+                expression.insert(broadcasts_models.Broadcast).values(
+                    type=message["type"], data=message["data"], topics=message["topics"]
+                ).returning(broadcasts_models.Broadcast.id)
+            )
+            await db.execute(
+                expression.delete(broadcasts_models.Broadcast).where(
+                    broadcasts_models.Broadcast.id <= seq - self.retention
+                )
+            )
+            await db.commit()
+        return seq
+
+    async def since(self, seq: int, limit: int) -> Optional[list[dict]]:
+        Broadcast = broadcasts_models.Broadcast
+        async with self.session_factory() as db:
+            first_seq, last_seq = (await db.execute(
+                expression.select(expression.func.min(Broadcast.id), expression.func.max(Broadcast.id))
+            )).one()
+            if first_seq is None or not first_seq - 1 <= seq <= last_seq:
+                return None
+            rows = (await db.execute(
+                expression.select(Broadcast.id, Broadcast.type, Broadcast.data, Broadcast.topics)
+                .where(Broadcast.id > seq)
+                .order_by(Broadcast.id)
+                .limit(limit + 1)
+            )).all()
+        if len(rows) > limit:
+            return None
+        return [{"type": row.type, "data": row.data, "topics": row.topics, "seq": row.id} for row in rows]
@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+from concurrent import futures
+from typing import Optional
+
+from passlib import context as passlib_context
+from starlette import concurrency
+
+from core import settings
+
+
+def get_context_options() -> dict:
+    # Keep sha256_crypt verifiable when another scheme is configured; every
+    # scheme but the first is deprecated so its hashes get upgraded on login.
+    options = {
+        "schemes": list(dict.fromkeys([settings.PASSWORD_HASH_SCHEME, "sha256_crypt"])),
+        "deprecated": "auto",
+    }
+    if settings.PASSWORD_HASH_ROUNDS:
+        for key in ("default_rounds", "min_rounds", "max_rounds"):
+            options[f"{settings.PASSWORD_HASH_SCHEME}__{key}"] = settings.PASSWORD_HASH_ROUNDS
+    return options
+
+
+pwd_context = passlib_context.CryptContext(**get_context_options())
+
+_executor: Optional[futures.ProcessPoolExecutor] = None
+
+
+def get_executor() -> Optional[futures.ProcessPoolExecutor]:
+    global _executor
+    if _executor is None and settings.PASSWORD_HASH_WORKERS > 0:
+        _executor = futures.ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+async def _run(function, *args):
+    executor = get_executor()
+    if executor is None:
+        return await concurrency.run_in_threadpool(function, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_and_update(password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    return await _run(_verify_and_update, password, hashed_password)
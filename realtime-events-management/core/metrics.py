@@ -0,0 +1,272 @@
+import bisect
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+import sqlalchemy as sa
+
+from core import profiler
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames: tuple[str, ...], labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# A minimal subset of the Prometheus client: metrics keyed by a tuple of label
+# values, rendered in the text exposition format. Updates only take a lock and
+# touch one dict entry, so they are cheap enough for every request.
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+        # Reads a total kept elsewhere at scrape time, see Gauge.
+        self.collect = collect
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        if self.collect is not None:
+            values = list(self.collect().items())
+        else:
+            with self._lock:
+                values = list(self.values.items())
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in values]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+        # Read at scrape time instead of being updated on every change.
+        self.collect = collect
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> list[str]:
+        if self.collect is not None:
+            values = list(self.collect().items())
+        else:
+            with self._lock:
+                values = list(self.values.items())
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in values]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"),
+))
+DB_QUERIES = REGISTRY.register(Counter(
+    "db_queries_total", "SQL statements executed while handling each route, by engine.", ("method", "route", "engine"),
+))
+HTTP_REQUESTS_THROTTLED = REGISTRY.register(Counter(
+    "http_requests_throttled_total", "HTTP requests refused by a rate or concurrency limit.", ("reason",),
+))
+WS_ACTIVE_CONNECTIONS = REGISTRY.register(Gauge(
+    "ws_active_connections", "Open WebSocket connections.",
+))
+WS_CONNECTIONS_CLOSED = REGISTRY.register(Counter(
+    "ws_connections_closed_total", "WebSocket connections refused over a limit or rate, or reaped when idle.", ("reason",),
+))
+WS_BROADCAST_FANOUT = REGISTRY.register(Histogram(
+    "ws_broadcast_fanout_seconds", "Time to queue one broadcast for every local recipient.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+))
+WS_BROADCAST_FAILURES = REGISTRY.register(Counter(
+    "ws_broadcast_failures_total", "Broadcast deliveries that failed, by reason.", ("reason",),
+))
+OUTBOX_DISPATCHED = REGISTRY.register(Counter(
+    "outbox_dispatched_total", "Outbox messages handed to the WebSocket manager.",
+))
+
+engines: dict[str, sa.Engine] = {}
+
+
+def collect_pool(attribute: str) -> Callable[[], dict[tuple, float]]:
+    def collect() -> dict[tuple, float]:
+        values = {}
+        for name, engine in engines.items():
+            method = getattr(engine.pool, attribute, None)
+            if method is not None:
+                values[(name,)] = method()
+        return values
+    return collect
+
+
+for attribute, documentation in (
+    ("size", "Connections the pool keeps open."),
+    ("checkedout", "Connections currently in use."),
+    ("overflow", "Connections opened beyond the pool size."),
+):
+    REGISTRY.register(Gauge(f"db_pool_{attribute}", documentation, ("engine",), collect=collect_pool(attribute)))
+
+def register_engine(engine: sa.Engine, name: str) -> None:
+    engines[name] = engine
+
+
+# Anything with a TTLCache-like stats() method.
+caches: dict[str, Any] = {}
+
+
+def collect_cache(key: str) -> Callable[[], dict[tuple, float]]:
+    def collect() -> dict[tuple, float]:
+        return {(name,): cache.stats()[key] for name, cache in caches.items()}
+    return collect
+
+
+for metric, key, documentation in (
+    (Counter, "hits", "Cache lookups that found a fresh entry."),
+    (Counter, "misses", "Cache lookups that found nothing or an expired entry."),
+    (Counter, "evictions", "Entries dropped to keep a cache within its size."),
+):
+    REGISTRY.register(metric(f"cache_{key}_total", documentation, ("cache",), collect=collect_cache(key)))
+REGISTRY.register(Gauge("cache_entries", "Entries held by a cache.", ("cache",), collect=collect_cache("size")))
+REGISTRY.register(Gauge(
+    "cache_hit_rate", "Share of cache lookups since startup that were hits.", ("cache",),
+    collect=collect_cache("hit_rate"),
+))
+
+
+def register_cache(cache, name: str) -> None:
+    caches[name] = cache
+
+
+class MetricsMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        # Set by the outer ProfilerMiddleware.
+        stats = profiler.current()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; unmatched
+            # paths share one label to keep cardinality bounded.
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], route, status)
+            if stats is not None:
+                for engine, count in stats.engines.items():
+                    DB_QUERIES.inc(scope["method"], route, engine, amount=count)
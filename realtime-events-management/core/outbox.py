@@ -0,0 +1,244 @@
+import asyncio
+import collections
+import datetime
+import logging
+from typing import Iterable, Optional
+
+import fastapi
+import sqlalchemy as sa
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.sql import expression
+
+from core import database, metrics, settings, ws_manager
+from models import outbox as outbox_models
+
+logger = logging.getLogger(__name__)
+
+
+def add(
+    db: sa_asyncio.AsyncSession, type: str, data: dict, topics: Optional[Iterable[str]] = None
+) -> outbox_models.OutboxMessage:
+    # Queues a broadcast in the session's transaction, so it is sent if and
+    # only if the change commits. The row starts out leased to this process,
+    # which sends it from memory after the commit (see committed()); other
+    # dispatchers only pick it up if that lease runs out.
+    row = outbox_models.OutboxMessage(
+        type=type,
+        data=data,
+        topics=None if topics is None else list(topics),
+        locked_until=datetime.datetime.now() + datetime.timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+    )
+    db.add(row)
+    return row
+
+
+def committed(background_tasks: fastapi.BackgroundTasks, *rows: outbox_models.OutboxMessage):
+    # After the commit: applies the messages' local effects (cache and version
+    # invalidation) before the response, so the writer reads its own change,
+    # and has the dispatcher send them without the request waiting.
+    dispatcher.enqueue(rows)
+    if not dispatcher.wake():
+        # No dispatcher task on this loop, e.g. without the app's lifespan:
+        # send once the response has been sent.
+        background_tasks.add_task(dispatcher.drain)
+
+
+# Hands outbox messages to the WebSocket manager, at least once: a message is
+# deleted only after it was published. Messages committed by this process are
+# sent from memory as soon as possible; a poll every poll_interval deletes
+# them and claims those whose lease ran out, e.g. after a failed send or a
+# crash. Each worker runs one dispatcher.
+class OutboxDispatcher:
+    def __init__(
+        self,
+        manager: ws_manager.ConnectionManager,
+        session_factory: sa_asyncio.async_sessionmaker = database.AsyncSessionLocal,
+        batch_size: int = settings.OUTBOX_BATCH_SIZE,
+        lease: float = settings.OUTBOX_LEASE_SECONDS,
+        poll_interval: float = settings.OUTBOX_POLL_INTERVAL,
+    ) -> None:
+        self.manager = manager
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        # (outbox id, message) committed here and not sent yet
+        self.queue: collections.deque[tuple[int, dict]] = collections.deque()
+        # (id, pending flush) of sent messages whose rows are not deleted
+        # yet; coalesced ones only count as sent once the flush ran.
+        self.published: list[tuple[int, Optional[asyncio.Future]]] = []
+        self._draining = False
+        self._pending = False
+        self._task: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def enqueue(self, rows: Iterable[outbox_models.OutboxMessage]):
+        for row in rows:
+            message = {"type": row.type, "data": row.data, "topics": row.topics}
+            # Listeners run again on delivery; like delivery itself, they
+            # must tolerate seeing a message twice.
+            for listener in self.manager.listeners:
+                try:
+                    listener(message)
+                except Exception:
+                    logger.exception("Broadcast listener failed")
+            self.queue.append((row.id, message))
+
+    async def claim(self, db: sa_asyncio.AsyncSession) -> list:
+        now = datetime.datetime.now()
+        claimable = (
+            expression.select(outbox_models.OutboxMessage.id)
+            .where(sa.or_(
+                outbox_models.OutboxMessage.locked_until.is_(None),
+                outbox_models.OutboxMessage.locked_until < now,
+            ))
+            .order_by(outbox_models.OutboxMessage.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.execute(
+            expression.update(outbox_models.OutboxMessage)
+            .where(outbox_models.OutboxMessage.id.in_(claimable))
+            .values(locked_until=now + datetime.timedelta(seconds=self.lease))
+            .returning(
+                outbox_models.OutboxMessage.id,
+                outbox_models.OutboxMessage.type,
+                outbox_models.OutboxMessage.data,
+                outbox_models.OutboxMessage.topics,
+            )
+        )
+        rows = sorted(result.all())
+        await db.commit()
+        return rows
+
+    async def publish(self, messages: Iterable[tuple[int, dict]]) -> int:
+        # Returns how many were published, up to the first failure. Coalesced
+        # messages are left to the manager's window timer.
+        published = 0
+        try:
+            for id, message in messages:
+                await self.manager.broadcast(message["type"], message["data"], message["topics"])
+                self.published.append((id, self.manager.pending_flush()))
+                published += 1
+        except Exception:
+            metrics.WS_BROADCAST_FAILURES.inc("outbox")
+            logger.exception("Outbox dispatch failed")
+        return published
+
+    async def send_queued(self):
+        messages = []
+        while self.queue:
+            messages.append(self.queue.popleft())
+        # Anything not published stays leased and is recovered later.
+        await self.publish(messages)
+
+    async def recover(self) -> int:
+        # Sends one batch of messages whose lease ran out; returns how many.
+        async with self.session_factory() as db:
+            rows = await self.claim(db)
+        return await self.publish(
+            (id, {"type": type, "data": data, "topics": topics}) for id, type, data, topics in rows
+        )
+
+    async def delete_published(self):
+        ids, waiting = [], []
+        for id, flushed in self.published:
+            if flushed is None or flushed.done() and not flushed.cancelled() and flushed.exception() is None:
+                ids.append(id)
+            elif not flushed.done() and not flushed.get_loop().is_closed():
+                waiting.append((id, flushed))
+            # Otherwise the flush failed or never ran, and the row is sent
+            # again once its lease runs out.
+        self.published = waiting
+        if not ids:
+            return
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    expression.delete(outbox_models.OutboxMessage)
+                    .where(outbox_models.OutboxMessage.id.in_(ids))
+                )
+                await db.commit()
+        except Exception:
+            self.published.extend((id, None) for id in ids)
+            raise
+        metrics.OUTBOX_DISPATCHED.inc(amount=len(ids))
+
+    async def drain(self):
+        # Sends what is queued, recovers what expired and deletes what was
+        # sent. Calls made while a drain runs only ask it for another pass.
+        if self._draining:
+            self._pending = True
+            return
+        self._draining = True
+        try:
+            while True:
+                self._pending = False
+                await self.send_queued()
+                await self.poll()
+                if not self._pending and not self.queue:
+                    break
+        except Exception:
+            # Left for the next poll.
+            logger.exception("Outbox drain failed")
+        finally:
+            self._draining = False
+
+    async def poll(self):
+        while await self.recover() >= self.batch_size:
+            pass
+        # Sent rows stay leased until then, and go in one statement, which
+        # keeps the database's write lock out of the way of requests.
+        await self.delete_published()
+
+    async def start(self):
+        task = self._task
+        if task is None or task.done() or task.get_loop().is_closed():
+            self._wakeup = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._task = loop.create_task(self._send())
+            self._poller = loop.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._poller.cancel()
+            self._task = self._poller = None
+            self._wakeup = None
+        try:
+            await self.send_queued()
+            # Publishes the coalesced messages, so their rows can go.
+            await self.manager.flush()
+        except Exception:
+            logger.exception("Outbox send failed")
+        await self.drain()
+
+    def wake(self) -> bool:
+        # Returns False when there is no running dispatcher task to wake.
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _send(self):
+        # Sending does not wait for polls, which may wait for the database.
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.send_queued()
+            except Exception:
+                logger.exception("Outbox send failed")
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Outbox poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+dispatcher = OutboxDispatcher(ws_manager.manager)
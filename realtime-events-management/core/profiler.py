@@ -0,0 +1,125 @@
+import collections
+import contextlib
+import contextvars
+import logging
+import time
+from typing import Iterator, Optional
+
+import sqlalchemy as sa
+
+from core import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    __slots__ = ("count", "duration", "engines", "statements")
+
+    def __init__(self, record: bool = False) -> None:
+        self.count = 0
+        self.duration = 0.0
+        # engine name -> statements it ran
+        self.engines: collections.Counter[str] = collections.Counter()
+        # Only kept when asked for, e.g. to explain a blown query budget.
+        self.statements: Optional[list[str]] = [] if record else None
+
+    def add(self, statement: str, duration: float, engine: str) -> None:
+        self.count += 1
+        self.duration += duration
+        self.engines[engine] += 1
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+# Statements of the current request. The same QueryStats object is shared by
+# threadpool workers and greenlets spawned from it, which copy the context.
+_request_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar("request_stats", default=None)
+# Stats collecting every statement on every instrumented engine, see query_budget().
+_recorders: list[QueryStats] = []
+# Names given to instrument(), e.g. primary or replica1.
+_engine_names: dict[sa.Engine, str] = {}
+
+
+def current() -> Optional[QueryStats]:
+    return _request_stats.get()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    engine = _engine_names.get(conn.engine, "unknown")
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(statement, duration, engine)
+    for recorder in _recorders:
+        recorder.add(statement, duration, engine)
+
+
+def handle_error(context: sa.engine.ExceptionContext) -> None:
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # so the next statement on the pooled connection is timed from its own.
+    if context.connection is not None and context.execution_context is not None:
+        started = context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def instrument(engine: sa.Engine, name: str = "primary") -> None:
+    _engine_names[engine] = name
+    if not sa.event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        sa.event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        sa.event.listen(engine, "handle_error", handle_error)
+
+
+@contextlib.contextmanager
+def query_budget(max_queries: int) -> Iterator[QueryStats]:
+    # Fails when the enclosed code, including requests it makes through a
+    # test client, runs more statements than declared.
+    stats = QueryStats(record=True)
+    _recorders.append(stats)
+    try:
+        yield stats
+    finally:
+        _recorders.remove(stats)
+    if stats.count > max_queries:
+        raise AssertionError(
+            f"{stats.count} queries over a budget of {max_queries}:\n" + "\n".join(stats.statements)
+        )
+
+
+class ProfilerMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and settings.DEVELOPMENT:
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"x-db-query-count", str(stats.count).encode()),
+                    (b"x-db-time-ms", f"{stats.duration * 1000:.2f}".encode()),
+                    (b"x-db-engines", ",".join(f"{name}={count}" for name, count in stats.engines.items()).encode()),
+                ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            if settings.SLOW_REQUEST_MS and elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s: %.0f ms, %d queries, %.0f ms in the database",
+                    scope["method"], scope["path"], elapsed * 1000, stats.count, stats.duration * 1000,
+                )
@@ -0,0 +1,218 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import socket
+import statistics
+import struct
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+from core import settings
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[dict], None]
+
+
+class InProcessBackend:
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, message: dict) -> None:
+        self._deliver(message)
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "memory"}
+
+
+class LatencyStats:
+    def __init__(self, size: int = 1024) -> None:
+        self.samples: collections.deque[float] = collections.deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"count": self.count}
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "p50_ms": statistics.median(ordered) * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+
+
+# Prefixes every datagram: message id, chunk index, chunk count.
+CHUNK_HEADER = struct.Struct("!16sHH")
+
+
+# Relays messages between workers on one host over Unix datagram sockets.
+# Every worker binds its own socket inside a shared directory and publishing
+# sends the message to each peer socket found there, so no broker process is
+# needed. Messages larger than one datagram are split into chunks and
+# reassembled by the receiver. Sockets left behind by dead workers are
+# removed on first refusal.
+class UnixSocketBackend:
+    def __init__(
+        self,
+        directory: str = settings.BROADCAST_UNIX_DIR,
+        peer_refresh_interval: float = 1.0,
+        max_datagram_size: int = settings.BROADCAST_MAX_DATAGRAM_SIZE,
+        send_timeout: float = settings.BROADCAST_SEND_TIMEOUT,
+        max_partial_messages: int = 64,
+    ) -> None:
+        self.directory = Path(directory or Path(tempfile.gettempdir()) / "realtime-events-bus")
+        self.peer_refresh_interval = peer_refresh_interval
+        self.max_datagram_size = max_datagram_size
+        self.send_timeout = send_timeout
+        self.max_partial_messages = max_partial_messages
+        self.path = self.directory / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+        self.latency = LatencyStats()
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self._sock: Optional[socket.socket] = None
+        self._peers: list[str] = []
+        self._peers_refreshed_at = 0.0
+        # message id -> chunks received so far
+        self._partial: collections.OrderedDict[bytes, list[Optional[bytes]]] = collections.OrderedDict()
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(self.path))
+        self._sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._sock.fileno(), self._receive)
+
+    async def publish(self, message: dict) -> None:
+        # Raises when a peer could not be sent the message, so the caller
+        # can retry it; peers that did get it may then see it twice.
+        datagrams = self._split(json.dumps({**message, "sent_at": time.time()}).encode())
+        self._deliver(message)
+        failed = 0
+        for peer in self._current_peers():
+            try:
+                for datagram in datagrams:
+                    # Waits while the peer's buffer is full.
+                    await asyncio.wait_for(self._loop.sock_sendto(self._sock, datagram, peer), self.send_timeout)
+                self.sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._forget_peer(peer)
+            except OSError:
+                self.dropped += 1
+                failed += 1
+                logger.warning("Failed to send broadcast to worker socket %s", peer, exc_info=True)
+        if failed:
+            raise ConnectionError(f"Broadcast not sent to {failed} worker(s)")
+
+    async def stop(self) -> None:
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        self.path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "unix",
+            "peers": len(self._peers),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "delivery_latency": self.latency.summary(),
+        }
+
+    def _current_peers(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._peers_refreshed_at >= self.peer_refresh_interval:
+            self._peers = [
+                str(path) for path in self.directory.glob("*.sock") if path != self.path
+            ]
+            self._peers_refreshed_at = now
+        return self._peers
+
+    def _forget_peer(self, peer: str) -> None:
+        if peer in self._peers:
+            self._peers.remove(peer)
+        Path(peer).unlink(missing_ok=True)
+
+    def _split(self, payload: bytes) -> list[bytes]:
+        size = self.max_datagram_size - CHUNK_HEADER.size
+        count = max(1, -(-len(payload) // size))
+        if count > 0xFFFF:
+            raise ValueError(f"Broadcast of {len(payload)} bytes is too large")
+        message_id = uuid.uuid4().bytes
+        return [
+            CHUNK_HEADER.pack(message_id, index, count) + payload[index * size:(index + 1) * size]
+            for index in range(count)
+        ]
+
+    def _reassemble(self, datagram: bytes) -> Optional[bytes]:
+        # Returns the payload once its last chunk arrived. Datagrams between
+        # two sockets arrive in order, but chunks of concurrent messages may
+        # interleave.
+        message_id, index, count = CHUNK_HEADER.unpack_from(datagram)
+        chunk = datagram[CHUNK_HEADER.size:]
+        if count == 1:
+            return chunk
+        chunks = self._partial.get(message_id)
+        if chunks is None:
+            chunks = self._partial[message_id] = [None] * count
+            while len(self._partial) > self.max_partial_messages:
+                # Its sender gave up half way.
+                self._partial.popitem(last=False)
+                self.errors += 1
+        chunks[index] = chunk
+        if index < count - 1 or None in chunks:
+            return None
+        del self._partial[message_id]
+        return b"".join(chunks)
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                datagram = self._sock.recv(self.max_datagram_size)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                payload = self._reassemble(datagram)
+                if payload is None:
+                    continue
+                message = json.loads(payload)
+                self.latency.record(time.time() - message.pop("sent_at"))
+            except Exception:
+                self.errors += 1
+                logger.warning("Discarding malformed broadcast datagram", exc_info=True)
+                continue
+            try:
+                self._deliver(message)
+            except Exception:
+                logger.exception("Failed to deliver broadcast from another worker")
+
+
+BACKENDS = {
+    "memory": InProcessBackend,
+    "unix": UnixSocketBackend,
+}
+
+
+def create_backend(name: str = settings.BROADCAST_BACKEND):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown broadcast backend: {name}")
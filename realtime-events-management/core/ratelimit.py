@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Hashable, Iterable
+
+from core import metrics
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        # Returns 0 when a token was taken, else the seconds until one is available.
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Token buckets per key (user, address, ...). A rate of 0 disables the limit.
+# Least recently used buckets are dropped past maxsize; a dropped bucket
+# comes back full, which only ever lets a quiet key through.
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, maxsize: int = 100_000) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.maxsize = maxsize
+        self._buckets: collections.OrderedDict[Hashable, TokenBucket] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable = None) -> float:
+        # Returns 0 when allowed, else the seconds to wait before retrying.
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(time.monotonic())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def overloaded_response(status: int, detail: str, retry_after: float) -> list[dict]:
+    body = f'{{"detail":"{detail}"}}'.encode()
+    return [
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, round(retry_after))).encode()),
+            ],
+        },
+        {"type": "http.response.body", "body": body},
+    ]
+
+
+# Admission control for HTTP requests: at most max_concurrency run at once and
+# at most max_queue wait for a slot, each for up to queue_timeout seconds.
+# Anything beyond that is answered 503 straight away instead of piling up on
+# the threadpool and the database pools.
+class ConcurrencyLimitMiddleware:
+    def __init__(
+        self,
+        app,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        exempt_paths: Iterable[str] = (),
+    ) -> None:
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.exempt_paths = frozenset(exempt_paths)
+        self.active = 0
+        self.waiters: collections.deque[asyncio.Future] = collections.deque()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_concurrency <= 0 or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if not await self._acquire():
+            for message in overloaded_response(503, "Server is busy, try again later", self.queue_timeout):
+                await send(message)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._release()
+
+    async def _acquire(self) -> bool:
+        if self.active < self.max_concurrency and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            metrics.HTTP_REQUESTS_THROTTLED.inc("overloaded")
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # A releasing request hands its slot over by resolving the future.
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Handed a slot just as the wait timed out; keep it.
+                return True
+            metrics.HTTP_REQUESTS_THROTTLED.inc("queue_timeout")
+            return False
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self.waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
@@ -0,0 +1,227 @@
+import array
+import asyncio
+import bisect
+import datetime
+import itertools
+import logging
+from typing import Callable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.sql import expression
+
+from core import database, settings, ws_manager
+from models import events as events_models
+from schemas import events as events_schemas
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+# A key packs (whole seconds since EPOCH, event id) into one signed 64-bit
+# integer, so the index is two flat sorted arrays of 8 bytes per entry rather
+# than a heap of tuples. Covers ids below 2**31 and the years 1834 to 2106.
+ID_LIMIT = 1 << 31
+SECONDS_LIMIT = 1 << 32
+
+
+def to_seconds(dt: datetime.datetime) -> int:
+    return (dt - EPOCH) // datetime.timedelta(seconds=1)
+
+
+def from_seconds(seconds: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+# Knows when every future event starts and every running event ends, and
+# sends event_starting/event_ended when those times come. Each worker keeps
+# its own index, loaded at startup and kept current by the event_created and
+# event_canceled broadcasts of every worker, and notifies its own sockets, so
+# no worker polls the database and no message is sent twice.
+class EventScheduler:
+    def __init__(
+        self,
+        manager: ws_manager.ConnectionManager,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+        max_sleep: float = 60.0,
+    ) -> None:
+        self.manager = manager
+        # Naive local time, like the events' date_time.
+        self.clock = clock
+        # Wake up at least this often, in case the wall clock jumps.
+        self.max_sleep = max_sleep
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        # Cancelled events are skipped lazily and compacted away in bulk.
+        self.cancelled: set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def add(self, event_id: int, date_time: datetime.datetime, duration: datetime.timedelta):
+        start, end = to_seconds(date_time), to_seconds(date_time + duration)
+        if not 0 <= event_id < ID_LIMIT or not -SECONDS_LIMIT < start <= end < SECONDS_LIMIT:
+            return
+        now = to_seconds(self.clock())
+        for keys, seconds in ((self.starts, start), (self.ends, end)):
+            if seconds >= now:
+                key = seconds * ID_LIMIT + event_id
+                index = bisect.bisect_left(keys, key)
+                if index < len(keys) and keys[index] == key:
+                    # Seen already, broadcasts may be delivered twice.
+                    continue
+                keys.insert(index, key)
+                if index == 0 and self._wakeup is not None:
+                    self._wakeup.set()
+
+    def cancel(self, event_id: int):
+        self.cancelled.add(event_id)
+        if len(self.cancelled) > max(1024, len(self.ends) // 8):
+            self.compact()
+
+    def compact(self):
+        cancelled = self.cancelled
+        self.starts = array.array("q", (key for key in self.starts if key % ID_LIMIT not in cancelled))
+        self.ends = array.array("q", (key for key in self.ends if key % ID_LIMIT not in cancelled))
+        self.cancelled = set()
+
+    def clear(self):
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        self.cancelled = set()
+
+    def handle_message(self, message: dict):
+        # Broadcast listener; sees the messages of every worker.
+        if message["type"] == "event_created":
+            events = [message["data"]]
+        elif message["type"] == "events_created":
+            events = message["data"]["events"]
+        elif message["type"] == "event_canceled":
+            self.cancel(message["data"]["id"])
+            return
+        else:
+            return
+        for event in events:
+            self.add(
+                event["id"],
+                datetime.datetime.fromisoformat(event["date_time"]),
+                events_schemas.parse_duration(event["duration"]),
+            )
+
+    async def load(self, session_factory: sa_asyncio.async_sessionmaker = database.AsyncSessionLocal):
+        now = self.clock()
+        starts, ends = [], []
+        async with session_factory() as db:
+            # Only events that could still be running can matter.
+            longest = await db.scalar(
+                expression.select(sa.func.max(events_models.Event.duration))
+                .where(events_models.Event.is_cancelled == False)
+            )
+            if longest is not None:
+                result = await db.stream(
+                    expression.select(
+                        events_models.Event.id, events_models.Event.date_time, events_models.Event.duration
+                    )
+                    .where(
+                        events_models.Event.is_cancelled == False,
+                        events_models.Event.date_time >= now - longest,
+                    )
+                    .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+                )
+                now = to_seconds(now)
+                async for event_id, date_time, duration in result:
+                    start, end = to_seconds(date_time), to_seconds(date_time + duration)
+                    if not 0 <= event_id < ID_LIMIT or not -SECONDS_LIMIT < start <= end < SECONDS_LIMIT:
+                        continue
+                    if start >= now:
+                        starts.append(start * ID_LIMIT + event_id)
+                    if end >= now:
+                        ends.append(end * ID_LIMIT + event_id)
+        # Keep whatever broadcasts added while loading.
+        self.starts = array.array("q", sorted(set(starts).union(self.starts)))
+        self.ends = array.array("q", sorted(set(ends).union(self.ends)))
+        logger.info("Scheduled %d starting and %d running events", len(self.starts), len(self.ends))
+
+    def due(self, now: int) -> tuple[list[int], list[int]]:
+        # Removes and returns the ids of events started and ended by now.
+        last = now * ID_LIMIT + ID_LIMIT - 1
+        index = bisect.bisect_right(self.starts, last)
+        started = [key % ID_LIMIT for key in self.starts[:index]]
+        del self.starts[:index]
+        index = bisect.bisect_right(self.ends, last)
+        ended_ids = [key % ID_LIMIT for key in self.ends[:index]]
+        del self.ends[:index]
+        started = [event_id for event_id in started if event_id not in self.cancelled]
+        ended = []
+        for event_id in ended_ids:
+            if event_id in self.cancelled:
+                # The end is an event's last key.
+                self.cancelled.discard(event_id)
+            else:
+                ended.append(event_id)
+        return started, ended
+
+    def upcoming(self, within: int, limit: int) -> list[tuple[int, datetime.datetime]]:
+        # Events starting in the next `within` seconds, soonest first.
+        last = (to_seconds(self.clock()) + within) * ID_LIMIT + ID_LIMIT - 1
+        events = []
+        for key in itertools.islice(self.starts, bisect.bisect_right(self.starts, last)):
+            seconds, event_id = divmod(key, ID_LIMIT)
+            if event_id not in self.cancelled:
+                events.append((event_id, from_seconds(seconds)))
+                if len(events) >= limit:
+                    break
+        return events
+
+    def tick(self) -> Optional[float]:
+        # Notifies what is due and returns the seconds until the next key.
+        now = self.clock()
+        started, ended = self.due(to_seconds(now))
+        for type, event_ids in (("event_starting", started), ("event_ended", ended)):
+            for event_id in event_ids:
+                self.manager.notify_local(
+                    type,
+                    {"id": event_id},
+                    topics=[ws_manager.EVENTS_TOPIC, ws_manager.event_topic(event_id)],
+                )
+        pending = [keys[0] // ID_LIMIT for keys in (self.starts, self.ends) if keys]
+        if not pending:
+            return None
+        return max(0.0, (from_seconds(min(pending)) - now).total_seconds())
+
+    async def start(self, session_factory: sa_asyncio.async_sessionmaker = database.AsyncSessionLocal):
+        await self.load(session_factory)
+        task = self._task
+        if task is None or task.done() or task.get_loop().is_closed():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._wakeup = None
+
+    async def _run(self):
+        while True:
+            try:
+                delay = self.tick()
+            except Exception:
+                logger.exception("Event scheduler tick failed")
+                delay = None
+            self._wakeup.clear()
+            timeout = self.max_sleep if delay is None else min(delay, self.max_sleep)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "starts": len(self.starts),
+            "ends": len(self.ends),
+            "cancelled": len(self.cancelled),
+            "bytes": self.starts.itemsize * (len(self.starts) + len(self.ends)),
+        }
+
+
+scheduler = EventScheduler(ws_manager.manager)
+ws_manager.manager.add_listener(scheduler.handle_message)
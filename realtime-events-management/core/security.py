@@ -16,12 +16,17 @@ def create_access_token(
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[int]:
+def decode_token(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            return None
-        return user_id
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
     except jose.JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def verify_token(token: str) -> Optional[int]:
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    user_id: int = payload.get("sub")
+    if user_id is None:
+        return None
+    return user_id
\ No newline at end of file
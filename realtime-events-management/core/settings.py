@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from decouple import AutoConfig
+from decouple import AutoConfig, Csv
 
 BASE_DIR = Path(__name__).resolve().parent
 config = AutoConfig(search_path = BASE_DIR)
@@ -8,5 +8,91 @@ config = AutoConfig(search_path = BASE_DIR)
 
 DEVELOPMENT = config('DEVELOPMENT', default=False, cast=bool)
 DATABASE_URL = config('DATABASE_URL', default='sqlite:///db.sqlite3')
+ASYNC_DATABASE_URL = config('ASYNC_DATABASE_URL', default='')
+# create, verify or skip; checked once at startup, see database.prepare_schema.
+DATABASE_SCHEMA = config('DATABASE_SCHEMA', default='create' if DEVELOPMENT else 'verify')
+DATABASE_POOL_PREWARM = config('DATABASE_POOL_PREWARM', default=2, cast=int)
+# Comma-separated URLs of read replicas for the GET endpoints.
+DATABASE_READ_URLS = config('DATABASE_READ_URLS', default='', cast=Csv())
+# How long a user's reads go to the primary after they write.
+DATABASE_READ_STICKY_SECONDS = config('DATABASE_READ_STICKY_SECONDS', default=5.0, cast=float)
+# Recent writers remembered per worker; the least recent are forgotten first.
+DATABASE_READ_STICKY_USERS = config('DATABASE_READ_STICKY_USERS', default=10000, cast=int)
 SECRET_KEY = config('SECRET_KEY', default='')
 ACCESS_TOKEN_EXPIRE_MINUTES = config('ACCESS_TOKEN_EXPIRE_MINUTES', default=60*24, cast=int)
+
+WS_SEND_QUEUE_SIZE = config('WS_SEND_QUEUE_SIZE', default=256, cast=int)
+WS_SEND_TIMEOUT = config('WS_SEND_TIMEOUT', default=5.0, cast=float)
+WS_SLOW_CONSUMER_POLICY = config('WS_SLOW_CONSUMER_POLICY', default='drop_oldest')
+WS_DEFAULT_TOPICS = config('WS_DEFAULT_TOPICS', default='*', cast=Csv())
+WS_COALESCE_WINDOW_MS = config('WS_COALESCE_WINDOW_MS', default=0, cast=int)
+WS_COALESCE_MAX_MESSAGES = config('WS_COALESCE_MAX_MESSAGES', default=100, cast=int)
+WS_DEFLATE_LEVEL = config('WS_DEFLATE_LEVEL', default=6, cast=int)
+WS_HEARTBEAT_INTERVAL = config('WS_HEARTBEAT_INTERVAL', default=20.0, cast=float)
+# Only application messages count as activity, not protocol-level pongs, so
+# reaping is off unless every client answers heartbeats.
+WS_IDLE_TIMEOUT = config('WS_IDLE_TIMEOUT', default=0.0, cast=float)
+WS_MAX_CONNECTIONS = config('WS_MAX_CONNECTIONS', default=10000, cast=int)
+WS_MAX_CONNECTIONS_PER_USER = config('WS_MAX_CONNECTIONS_PER_USER', default=10, cast=int)
+# Anonymous clients behind one NAT or proxy share an address.
+WS_MAX_CONNECTIONS_PER_ADDRESS = config('WS_MAX_CONNECTIONS_PER_ADDRESS', default=0, cast=int)
+# New connections accepted per second across the process, with bursts.
+WS_ACCEPT_RATE = config('WS_ACCEPT_RATE', default=100.0, cast=float)
+WS_ACCEPT_BURST = config('WS_ACCEPT_BURST', default=200, cast=int)
+WS_SHUTDOWN_TIMEOUT = config('WS_SHUTDOWN_TIMEOUT', default=5.0, cast=float)
+WS_REPLAY_BUFFER_SIZE = config('WS_REPLAY_BUFFER_SIZE', default=1000, cast=int)
+WS_REPLAY_PERSIST = config('WS_REPLAY_PERSIST', default=False, cast=bool)
+
+# Broadcasts go through an outbox table. The writing worker sends them from
+# memory; polls delete sent rows and resend any whose lease ran out.
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=100, cast=int)
+OUTBOX_LEASE_SECONDS = config('OUTBOX_LEASE_SECONDS', default=30.0, cast=float)
+OUTBOX_POLL_INTERVAL = config('OUTBOX_POLL_INTERVAL', default=1.0, cast=float)
+
+BROADCAST_BACKEND = config('BROADCAST_BACKEND', default='memory')
+BROADCAST_UNIX_DIR = config('BROADCAST_UNIX_DIR', default='')
+# Larger broadcasts are split into datagrams of at most this size.
+BROADCAST_MAX_DATAGRAM_SIZE = config('BROADCAST_MAX_DATAGRAM_SIZE', default=64*1024, cast=int)
+# A peer whose buffer stays full this long fails the publish.
+BROADCAST_SEND_TIMEOUT = config('BROADCAST_SEND_TIMEOUT', default=1.0, cast=float)
+
+EVENTS_PAGE_SIZE = config('EVENTS_PAGE_SIZE', default=50, cast=int)
+EVENTS_MAX_PAGE_SIZE = config('EVENTS_MAX_PAGE_SIZE', default=200, cast=int)
+# Longest window GET /events/upcoming answers for, in seconds.
+EVENTS_UPCOMING_MAX_WITHIN = config('EVENTS_UPCOMING_MAX_WITHIN', default=7*24*3600, cast=int)
+BULK_MAX_ITEMS = config('BULK_MAX_ITEMS', default=5000, cast=int)
+
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+TOKEN_CACHE_TTL = config('TOKEN_CACHE_TTL', default=300, cast=float)
+
+PASSWORD_HASH_SCHEME = config('PASSWORD_HASH_SCHEME', default='sha256_crypt')
+PASSWORD_HASH_ROUNDS = config('PASSWORD_HASH_ROUNDS', default=0, cast=int)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=2, cast=int)
+
+EVENT_DETAIL_CACHE_SIZE = config('EVENT_DETAIL_CACHE_SIZE', default=1024, cast=int)
+EVENT_DETAIL_CACHE_TTL = config('EVENT_DETAIL_CACHE_TTL', default=60, cast=float)
+
+# Versions are bumped by broadcasts, so with several workers ETags are only
+# current when every worker receives them; "memory" reaches one process only.
+# Single-process deployments can turn them on with the memory backend.
+EVENT_ETAGS = config('EVENT_ETAGS', default=BROADCAST_BACKEND != 'memory', cast=bool)
+# Events whose change counter is remembered for ETags; older ones share one.
+EVENT_VERSIONS_SIZE = config('EVENT_VERSIONS_SIZE', default=100000, cast=int)
+
+EXPORT_BATCH_SIZE = config('EXPORT_BATCH_SIZE', default=1000, cast=int)
+
+# Token buckets for write endpoints, per user and per client address
+# (login and registration); a rate of 0 disables them.
+RATE_LIMIT_USER_RATE = config('RATE_LIMIT_USER_RATE', default=10.0, cast=float)
+RATE_LIMIT_USER_BURST = config('RATE_LIMIT_USER_BURST', default=30, cast=int)
+RATE_LIMIT_ADDRESS_RATE = config('RATE_LIMIT_ADDRESS_RATE', default=5.0, cast=float)
+RATE_LIMIT_ADDRESS_BURST = config('RATE_LIMIT_ADDRESS_BURST', default=20, cast=int)
+RATE_LIMIT_MAX_KEYS = config('RATE_LIMIT_MAX_KEYS', default=100000, cast=int)
+# HTTP requests handled at once, and waiting for a slot, before answering
+# 503; 0 disables the limit.
+MAX_CONCURRENT_REQUESTS = config('MAX_CONCURRENT_REQUESTS', default=64, cast=int)
+MAX_QUEUED_REQUESTS = config('MAX_QUEUED_REQUESTS', default=128, cast=int)
+REQUEST_QUEUE_TIMEOUT = config('REQUEST_QUEUE_TIMEOUT', default=2.0, cast=float)
+
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=float)
@@ -0,0 +1,66 @@
+import collections
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+
+
+# Change counters for ETags: one for the whole catalogue and one per event,
+# all drawn from the same sequence. They live in memory, so tags also carry a
+# nonce chosen when the process starts and are never reused after a restart.
+# Only the most recently changed events are remembered; any other event
+# reports `floor`, the counter at the last time one was forgotten, which is
+# never below the version it had. A forgotten event can thus only produce a
+# spurious change, never a false match.
+class Versions:
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.nonce = uuid.uuid4().hex[:12]
+        self.counter = 0
+        # time.monotonic() of the latest change
+        self.changed_at = 0.0
+        self.floor = (0, 0.0)
+        self._events: collections.OrderedDict[int, tuple[int, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self, event_ids: Iterable[int]):
+        with self._lock:
+            self.counter += 1
+            self.changed_at = time.monotonic()
+            for event_id in event_ids:
+                self._events[event_id] = (self.counter, self.changed_at)
+                self._events.move_to_end(event_id)
+            while len(self._events) > self.maxsize:
+                self._events.popitem(last=False)
+                self.floor = (self.counter, self.changed_at)
+
+    def bump_all(self):
+        with self._lock:
+            self.counter += 1
+            self.changed_at = time.monotonic()
+            self.floor = (self.counter, self.changed_at)
+            self._events.clear()
+
+    def catalogue(self) -> tuple[int, float]:
+        return self.counter, self.changed_at
+
+    def event(self, event_id: int) -> tuple[int, float]:
+        return self._events.get(event_id, self.floor)
+
+    def known(self, event_id: int) -> bool:
+        # Whether the event changed recently, which means it exists.
+        return event_id in self._events
+
+    def etag(self, version: int) -> str:
+        return f'"{self.nonce}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
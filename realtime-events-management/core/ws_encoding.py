@@ -0,0 +1,54 @@
+import json
+import zlib
+from typing import NamedTuple, Optional, Union
+
+import msgpack
+
+from core import settings
+
+JSON = "json"
+MSGPACK = "msgpack"
+ENCODINGS = (JSON, MSGPACK)
+
+DEFLATE = "deflate"
+COMPRESSIONS = (DEFLATE,)
+
+
+# What a client asked for when connecting. JSON without compression goes
+# out as text frames, everything else as binary frames.
+class Format(NamedTuple):
+    encoding: str = JSON
+    compression: Optional[str] = None
+
+
+DEFAULT_FORMAT = Format()
+
+
+def encode(payload: dict, format: Format = DEFAULT_FORMAT) -> Union[str, bytes]:
+    if format.encoding == MSGPACK:
+        data = msgpack.packb(payload)
+    else:
+        data = json.dumps(payload)
+    if format.compression == DEFLATE:
+        # Raw deflate, as permessage-deflate would put on the wire, but done
+        # once per message instead of once per socket.
+        if isinstance(data, str):
+            data = data.encode()
+        compressor = zlib.compressobj(settings.WS_DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(data) + compressor.flush()
+    return data
+
+
+# A message to send to many sockets, encoded lazily and at most once per format.
+class Frame:
+    __slots__ = ("payload", "_encoded")
+
+    def __init__(self, payload: dict) -> None:
+        self.payload = payload
+        self._encoded: dict[Format, Union[str, bytes]] = {}
+
+    def encode(self, format: Format = DEFAULT_FORMAT) -> Union[str, bytes]:
+        encoded = self._encoded.get(format)
+        if encoded is None:
+            encoded = self._encoded[format] = encode(self.payload, format)
+        return encoded
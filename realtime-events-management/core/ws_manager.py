@@ -1,31 +1,605 @@
-import json
+import asyncio
+import collections
+import logging
+import time
+import uuid
+from typing import Callable, Hashable, Iterable, Optional, Union
 
 import fastapi
+from fastapi import status as fastapi_status
 
-class ConnectionManager:
+from core import database, event_log, metrics, pubsub, ratelimit, settings, ws_encoding
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+ALL_TOPICS = "*"
+EVENTS_TOPIC = "events"
+EVENT_TOPIC_PREFIX = "event:"
+
+# Connection limit keys of anonymous clients start with this.
+ADDRESS_KEY_PREFIX = "address:"
+
+
+def event_topic(event_id: int) -> str:
+    return f"{EVENT_TOPIC_PREFIX}{event_id}"
+
+
+def validate_topic(topic: str) -> str:
+    if topic in (ALL_TOPICS, EVENTS_TOPIC):
+        return topic
+    if topic.startswith(EVENT_TOPIC_PREFIX) and topic[len(EVENT_TOPIC_PREFIX):].isdigit():
+        return event_topic(int(topic[len(EVENT_TOPIC_PREFIX):]))
+    raise ValueError(f"Unknown topic: {topic}")
+
+
+def coalesce_key(type: str, data: dict) -> Optional[Hashable]:
+    # Messages sharing a key describe the same piece of state, so under the
+    # coalesce policy a newer one may replace an older one still queued.
+    if type in ("joined_event", "left_event"):
+        return ("participant", data.get("id"), data.get("participant", {}).get("id"))
+    if type in ("event_created", "event_canceled"):
+        return ("event", data.get("id"))
+    return None
+
+
+COALESCED_TYPES = ("joined_event", "left_event")
+
+# Shared by every socket, so it is encoded once per format for good.
+HEARTBEAT = ws_encoding.Frame({"type": "heartbeat"})
+
+
+# Collects joined_event/left_event messages and merges them per event into
+# participants_changed frames. A join and a leave by the same user within one
+# window cancel out.
+class ParticipantCoalescer:
     def __init__(self) -> None:
-        self.active_connections: list[fastapi.WebSocket] = []
+        self.pending: dict[int, dict[int, list]] = {}
+        self.count = 0
+
+    def add(self, type: str, data: dict) -> None:
+        action = "joined" if type == "joined_event" else "left"
+        participant = data["participant"]
+        changes = self.pending.setdefault(data["id"], {})
+        if participant["id"] in changes:
+            changes[participant["id"]][1:] = [action, participant]
+        else:
+            changes[participant["id"]] = [action, action, participant]
+        self.count += 1
+
+    def drain(self) -> list[tuple[dict, list[str]]]:
+        pending, self.pending, self.count = self.pending, {}, 0
+        frames = []
+        for event_id, changes in pending.items():
+            joined = [participant for first, last, participant in changes.values() if first == last == "joined"]
+            left = [participant for first, last, participant in changes.values() if first == last == "left"]
+            if joined or left:
+                frames.append((
+                    {"events": [{"id": event_id, "joined": joined, "left": left}]},
+                    [event_topic(event_id)],
+                ))
+        return frames
+
+
+class Connection:
+    def __init__(
+        self,
+        websocket: fastapi.WebSocket,
+        manager: "ConnectionManager",
+        format: ws_encoding.Format = ws_encoding.DEFAULT_FORMAT,
+        user_key: Optional[str] = None,
+    ) -> None:
+        self.websocket = websocket
+        self.manager = manager
+        self.format = format
+        self.user_key = user_key
+        # Any message from the client counts as a sign of life.
+        self.last_seen = time.monotonic()
+        self.queue: collections.deque[tuple[Optional[Hashable], Union[str, bytes]]] = collections.deque()
+        self.topics: set[str] = set()
+        self.dropped = 0
+        self.close_code: Optional[int] = None
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.writer = self._loop.create_task(self._drain())
+
+    def put(self, message: Union[str, ws_encoding.Frame], key: Optional[Hashable] = None) -> bool:
+        # Never waits on the socket; False means the consumer must be evicted.
+        if self.close_code is not None:
+            return True
+        if isinstance(message, ws_encoding.Frame):
+            message = message.encode(self.format)
+        if len(self.queue) >= self.manager.max_queue_size:
+            if self.manager.slow_consumer_policy == DISCONNECT:
+                return False
+            self.dropped += 1
+            if not self._coalesce(key):
+                self.queue.popleft()
+        self.queue.append((key, message))
+        self._wake()
+        return True
+
+    def wants(self, topics: Optional[Iterable[str]]) -> bool:
+        return topics is None or ALL_TOPICS in self.topics or not self.topics.isdisjoint(topics)
+
+    def close(self, code: int = fastapi_status.WS_1008_POLICY_VIOLATION) -> None:
+        if self.close_code is None:
+            self.close_code = code
+            self.queue.clear()
+            self._wake()
+
+    def _coalesce(self, key: Optional[Hashable]) -> bool:
+        if self.manager.slow_consumer_policy != COALESCE or key is None:
+            return False
+        for index, (queued_key, _) in enumerate(self.queue):
+            if queued_key == key:
+                del self.queue[index]
+                return True
+        return False
+
+    def _wake(self) -> None:
+        # Broadcasts may come from another event loop (e.g. a threadpool
+        # endpoint), so only touch the event from the writer's own loop.
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _drain(self) -> None:
+        try:
+            while self.close_code is None:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, message = self.queue.popleft()
+                send = self.websocket.send_bytes if isinstance(message, bytes) else self.websocket.send_text
+                await asyncio.wait_for(send(message), timeout=self.manager.send_timeout)
+            await asyncio.wait_for(
+                self.websocket.close(code=self.close_code),
+                timeout=self.manager.send_timeout,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.WS_BROADCAST_FAILURES.inc("send")
+            logger.info("Dropping websocket connection after failed send", exc_info=True)
+            # Tell the client, so it does not stay connected receiving nothing.
+            self.close_code = fastapi_status.WS_1011_INTERNAL_ERROR
+            try:
+                await asyncio.wait_for(
+                    self.websocket.close(code=self.close_code),
+                    timeout=self.manager.send_timeout,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+        self.manager.disconnect(self.websocket)
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        max_queue_size: int = settings.WS_SEND_QUEUE_SIZE,
+        send_timeout: float = settings.WS_SEND_TIMEOUT,
+        slow_consumer_policy: str = settings.WS_SLOW_CONSUMER_POLICY,
+        default_topics: Iterable[str] = settings.WS_DEFAULT_TOPICS,
+        backend=None,
+        coalesce_window: float = settings.WS_COALESCE_WINDOW_MS / 1000,
+        coalesce_max_messages: int = settings.WS_COALESCE_MAX_MESSAGES,
+        replay_buffer_size: int = settings.WS_REPLAY_BUFFER_SIZE,
+        event_store: Optional[event_log.DatabaseEventStore] = None,
+        heartbeat_interval: float = settings.WS_HEARTBEAT_INTERVAL,
+        idle_timeout: float = settings.WS_IDLE_TIMEOUT,
+        max_connections: int = settings.WS_MAX_CONNECTIONS,
+        max_connections_per_user: int = settings.WS_MAX_CONNECTIONS_PER_USER,
+        max_connections_per_address: int = settings.WS_MAX_CONNECTIONS_PER_ADDRESS,
+        accept_rate: float = settings.WS_ACCEPT_RATE,
+        accept_burst: int = settings.WS_ACCEPT_BURST,
+    ) -> None:
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+        self.max_queue_size = max_queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.default_topics = [validate_topic(topic) for topic in default_topics]
+        self.active_connections: dict[fastapi.WebSocket, Connection] = {}
+        self.subscribers: dict[str, set[fastapi.WebSocket]] = collections.defaultdict(set)
+        self.backend = backend or pubsub.InProcessBackend()
+        self.listeners: list[Callable[[dict], None]] = []
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_messages = coalesce_max_messages
+        self._coalescer = ParticipantCoalescer()
+        self.event_store = event_store
+        self.event_log = event_log.EventLog(
+            replay_buffer_size,
+            epoch=event_log.PERSISTENT_EPOCH if event_store else uuid.uuid4().hex[:12],
+        )
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+        self.max_connections_per_address = max_connections_per_address
+        # Includes connections still being accepted, so limits can't be raced.
+        self.connection_count = 0
+        self.connections_per_user: collections.Counter[str] = collections.Counter()
+        # Spreads a reconnect storm out instead of replaying to everyone at once.
+        self.accept_limiter = ratelimit.RateLimiter(accept_rate, accept_burst)
+        self._flush_task: Optional[asyncio.Task] = None
+        # Resolved once the changes now in the coalescer are published.
+        self._flushed: Optional[asyncio.Future] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._started = False
+
+    async def start(self):
+        if not self._started:
+            self._started = True
+            await self.backend.start(self._deliver)
+        self._start_heartbeat()
 
-    async def connect(self, websocket: fastapi.WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._started:
+            await self.flush()
+            self._started = False
+            await self.backend.stop()
+
+    def _start_heartbeat(self):
+        # One timer for all sockets instead of a task per socket.
+        if self.heartbeat_interval <= 0:
+            return
+        task = self._heartbeat_task
+        if task is None or task.done() or task.get_loop().is_closed():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.sweep()
+
+    def sweep(self):
+        # Reaps connections that stayed silent for too long and sends the
+        # others a heartbeat to answer. Busy connections need none: their
+        # writer is already exercising the socket.
+        now = time.monotonic()
+        for connection in list(self.active_connections.values()):
+            if self.idle_timeout > 0 and now - connection.last_seen > self.idle_timeout:
+                metrics.WS_CONNECTIONS_CLOSED.inc("idle")
+                connection.close(fastapi_status.WS_1001_GOING_AWAY)
+            elif not connection.queue and not connection.put(HEARTBEAT):
+                connection.close()
+
+    def touch(self, websocket: fastapi.WebSocket):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    def _reserve(self, user_key: Optional[str]) -> bool:
+        if self.max_connections > 0 and self.connection_count >= self.max_connections:
+            return False
+        if user_key is not None:
+            limit = self.max_connections_per_address if user_key.startswith(ADDRESS_KEY_PREFIX) \
+                else self.max_connections_per_user
+            if limit > 0 and self.connections_per_user[user_key] >= limit:
+                return False
+        self.connection_count += 1
+        if user_key is not None:
+            self.connections_per_user[user_key] += 1
+        return True
+
+    def _release(self, user_key: Optional[str]):
+        self.connection_count -= 1
+        if user_key is not None:
+            self.connections_per_user[user_key] -= 1
+            if self.connections_per_user[user_key] <= 0:
+                del self.connections_per_user[user_key]
+
+    def stats(self) -> dict:
+        connections = list(self.active_connections.values())
+        queued_bytes = sum(len(message) for connection in connections for _, message in connection.queue)
+        return {
+            "connections": len(connections),
+            "users": len(self.connections_per_user),
+            "queued_messages": sum(len(connection.queue) for connection in connections),
+            "queued_bytes": queued_bytes,
+        }
+
+    async def shutdown(
+        self,
+        code: int = fastapi_status.WS_1012_SERVICE_RESTART,
+        timeout: float = settings.WS_SHUTDOWN_TIMEOUT,
+    ):
+        # Sends what is already queued, then tells clients to reconnect
+        # (resuming from their last seq) to another worker.
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline and any(connection.queue for connection in self.active_connections.values()):
+            await asyncio.sleep(0.01)
+        writers = []
+        for connection in list(self.active_connections.values()):
+            connection.close(code)
+            if connection._loop is loop:
+                writers.append(connection.writer)
+        if writers:
+            await asyncio.wait(writers, timeout=max(deadline - loop.time(), 0.1))
+        await self.stop()
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        # Listeners see every delivered message, including those published by
+        # other workers, e.g. to invalidate per-worker caches.
+        self.listeners.append(listener)
+
+    async def connect(
+        self,
+        websocket: fastapi.WebSocket,
+        topics: Optional[Iterable[str]] = None,
+        last_seq: Optional[int] = None,
+        epoch: Optional[str] = None,
+        format: ws_encoding.Format = ws_encoding.DEFAULT_FORMAT,
+        user_key: Optional[str] = None,
+    ) -> bool:
+        # Returns False, after closing the socket, when a connection limit or
+        # the accept rate is exceeded.
+        await self.start()
+        refused = None
+        if self.accept_limiter.acquire():
+            refused = "rate"
+        elif not self._reserve(user_key):
+            refused = "limit"
+        if refused is not None:
+            metrics.WS_CONNECTIONS_CLOSED.inc(refused)
+            await websocket.accept()
+            await websocket.close(code=fastapi_status.WS_1013_TRY_AGAIN_LATER)
+            return False
+        try:
+            await websocket.accept()
+            missed = None
+            if last_seq is not None:
+                missed = await self.missed_since(last_seq, epoch)
+        except BaseException:
+            self._release(user_key)
+            raise
+        # No awaits from here on, so nothing is delivered between the replay
+        # and the first live message.
+        connection = Connection(websocket, self, format, user_key)
+        self.active_connections[websocket] = connection
+        metrics.WS_ACTIVE_CONNECTIONS.inc()
+        self.subscribe(websocket, self.default_topics if topics is None else topics)
+        if last_seq is None:
+            return True
+        if missed is None:
+            connection.put(ws_encoding.Frame({"type": "resync_required", "data": {"epoch": self.event_log.epoch}}))
+            return True
+        for entry in missed:
+            if connection.wants(entry.topics):
+                connection.put(entry.frame, entry.key)
+        return True
+
+    async def missed_since(self, seq: int, epoch: Optional[str]) -> Optional[list[event_log.Entry]]:
+        # Replaying more than fits in a send queue would just drop messages.
+        if epoch != self.event_log.epoch:
+            return None
+        missed = self.event_log.since(seq, self.max_queue_size)
+        if missed is not None or self.event_store is None:
+            return missed
+        stored = await self.event_store.since(seq, self.max_queue_size)
+        if stored is None:
+            return None
+        # Messages delivered while the query ran are only in memory.
+        last_stored = stored[-1]["seq"] if stored else seq
+        return [self._entry(message) for message in stored] + [
+            entry for entry in self.event_log.entries if entry.seq > last_stored
+        ]
 
     def disconnect(self, websocket: fastapi.WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        metrics.WS_ACTIVE_CONNECTIONS.dec()
+        self._release(connection.user_key)
+        self.unsubscribe(websocket, list(connection.topics), connection)
+        if connection.writer.done() or connection._loop.is_closed():
+            return
+        try:
+            current_task = asyncio.current_task()
+        except RuntimeError:
+            current_task = None
+        if connection.writer is not current_task:
+            connection._loop.call_soon_threadsafe(connection.writer.cancel)
+
+    def subscribe(self, websocket: fastapi.WebSocket, topics: Iterable[str]) -> set[str]:
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            # Dropped after a failed send; its socket is closed or closing.
+            return set()
+        for topic in topics:
+            connection.topics.add(topic)
+            self.subscribers[topic].add(websocket)
+        return connection.topics
+
+    def unsubscribe(
+        self,
+        websocket: fastapi.WebSocket,
+        topics: Iterable[str],
+        connection: Optional[Connection] = None,
+    ) -> set[str]:
+        connection = connection or self.active_connections.get(websocket)
+        if connection is None:
+            return set()
+        for topic in topics:
+            connection.topics.discard(topic)
+            sockets = self.subscribers.get(topic)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.subscribers[topic]
+        return connection.topics
+
+    def recipients(self, topics: Optional[Iterable[str]]) -> list[Connection]:
+        if topics is None:
+            return list(self.active_connections.values())
+        websockets = set(self.subscribers.get(ALL_TOPICS, ()))
+        for topic in topics:
+            websockets.update(self.subscribers.get(topic, ()))
+        return [
+            connection for connection in map(self.active_connections.get, websockets)
+            if connection is not None
+        ]
+
+    async def send_personal_message(self, message: Union[str, dict], websocket: fastapi.WebSocket):
+        # Dicts are encoded in the format the client asked for.
+        connection = self.active_connections.get(websocket)
+        if isinstance(message, dict):
+            message = ws_encoding.Frame(message)
+        if connection is not None and not connection.put(message):
+            connection.close()
 
-    async def send_personal_message(self, message: str, websocket: fastapi.WebSocket):
-        await websocket.send_text(message)
+    def notify_local(self, type: str, data: dict, topics: Optional[Iterable[str]] = None):
+        # For messages every worker derives by itself, e.g. scheduled
+        # reminders: delivered to this worker's sockets only, without a seq,
+        # so they are neither published to other workers nor replayed.
+        frame = ws_encoding.Frame({"type": type, "data": data})
+        started = time.perf_counter()
+        for connection in self.recipients(None if topics is None else list(topics)):
+            if not connection.put(frame):
+                metrics.WS_BROADCAST_FAILURES.inc("evicted")
+                connection.close()
+        metrics.WS_BROADCAST_FANOUT.observe(time.perf_counter() - started)
 
-    async def broadcast(self, type: str, data: dict):
+    async def broadcast(self, type: str, data: dict, topics: Optional[Iterable[str]] = None):
+        await self.start()
+        if self.coalesce_window > 0 and type in COALESCED_TYPES:
+            self._coalescer.add(type, data)
+            if self._coalescer.count >= self.coalesce_max_messages:
+                await self.flush()
+            elif self._flush_task is None:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            return
+        # Anything else may depend on the pending changes, e.g. a cancellation.
+        await self.flush()
+        await self._publish(type, data, topics)
+
+    def pending_flush(self) -> Optional[asyncio.Future]:
+        # None when nothing is waiting in the coalescer; else a future that
+        # resolves when it was published, or fails with the flush.
+        if not self._coalescer.count:
+            return None
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+        return self._flushed
+
+    async def flush(self):
+        frames = self._coalescer.drain()
+        flushed, self._flushed = self._flushed, None
+        try:
+            for data, topics in frames:
+                await self._publish("participants_changed", data, topics)
+        except Exception as error:
+            if flushed is not None and not flushed.done():
+                flushed.set_exception(error)
+            raise
+        if flushed is not None and not flushed.done():
+            flushed.set_result(None)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.coalesce_window)
+        self._flush_task = None
+        await self.flush()
+
+    async def _publish(self, type: str, data: dict, topics: Optional[Iterable[str]]):
         message = {
             "type": type,
-            "data": data
+            "data": data,
+            "topics": None if topics is None else list(topics),
         }
-        json_message = json.dumps(message)
-        for connection in self.active_connections:
+        try:
+            if self.event_store is not None:
+                message["seq"] = await self.event_store.append(message)
+            await self.backend.publish(message)
+        except Exception:
+            metrics.WS_BROADCAST_FAILURES.inc("publish")
+            raise
+
+    def _entry(self, message: dict) -> event_log.Entry:
+        seq = message.get("seq") or self.event_log.next_seq()
+        frame = ws_encoding.Frame({
+            "type": message["type"],
+            "data": message["data"],
+            "seq": seq,
+            "epoch": self.event_log.epoch,
+        })
+        return event_log.Entry(seq, message["topics"], coalesce_key(message["type"], message["data"]), frame)
+
+    def _deliver(self, message: dict):
+        # Called by the backend for every message, including those published
+        # by other workers; the frame is encoded once per format for all
+        # local sockets.
+        # Without an event store each worker numbers messages itself.
+        started = time.perf_counter()
+        for listener in self.listeners:
             try:
-                await connection.send_text(json_message)
+                listener(message)
             except Exception:
-                self.disconnect(connection)
+                metrics.WS_BROADCAST_FAILURES.inc("listener")
+                logger.exception("Broadcast listener failed")
+        entry = self._entry(message)
+        self.event_log.append(entry)
+        for connection in self.recipients(message["topics"]):
+            if not connection.put(entry.frame, entry.key):
+                metrics.WS_BROADCAST_FAILURES.inc("evicted")
+                connection.close()
+        metrics.WS_BROADCAST_FANOUT.observe(time.perf_counter() - started)
+
+manager = ConnectionManager(
+    backend=pubsub.create_backend(),
+    event_store=event_log.DatabaseEventStore(
+        database.AsyncSessionLocal, retention=settings.WS_REPLAY_BUFFER_SIZE
+    ) if settings.WS_REPLAY_PERSIST else None,
+)
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "ws_send_queue_bytes", "Bytes waiting in WebSocket send queues.",
+    collect=lambda: {(): manager.stats()["queued_bytes"]},
+))
+
+
+# Only backends relaying between workers report these.
+def collect_bus(key: str) -> Callable[[], dict[tuple, float]]:
+    def collect() -> dict[tuple, float]:
+        value = manager.backend.stats().get(key)
+        return {} if value is None else {(): value}
+    return collect
+
+
+for key, documentation in (
+    ("sent", "Broadcasts sent to other workers, counted once per worker."),
+    ("dropped", "Broadcasts that could not be sent to another worker."),
+    ("errors", "Malformed or incomplete broadcasts received from other workers."),
+):
+    metrics.REGISTRY.register(metrics.Counter(f"broadcast_bus_{key}_total", documentation, collect=collect_bus(key)))
+
+
+def collect_bus_latency() -> dict[tuple, float]:
+    summary = manager.backend.stats().get("delivery_latency", {})
+    quantiles = (("0.5", "p50_ms"), ("0.99", "p99_ms"), ("1", "max_ms"))
+    return {(quantile,): summary[key] / 1000 for quantile, key in quantiles if key in summary}
+
 
-manager = ConnectionManager()
+metrics.REGISTRY.register(metrics.Gauge(
+    "broadcast_bus_delivery_latency_seconds",
+    "Time from publishing a broadcast to its delivery by this worker, over recent messages.",
+    ("quantile",),
+    collect=collect_bus_latency,
+))
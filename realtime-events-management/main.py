@@ -1,13 +1,46 @@
+import contextlib
+
 from fastapi import FastAPI
 from fastapi.middleware import cors
+from starlette import concurrency
+
+from api.endpoints import auth, events, metrics as metrics_endpoints, websocket
+from core import database, hashing, metrics, outbox, profiler, ratelimit, scheduler, settings, ws_manager
+from schemas import events as events_schemas
 
-from api.endpoints import auth, events, websocket
-from core import database
 
-database.Base.metadata.create_all(bind=database.engine)
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup work runs once per worker here rather than on import, so tests
+    # and tools importing the app don't touch the database.
+    await concurrency.run_in_threadpool(database.prepare_schema)
+    await database.prewarm_pools()
+    events_schemas.prewarm()
+    await ws_manager.manager.start()
+    await scheduler.scheduler.start()
+    await outbox.dispatcher.start()
+    yield
+    await outbox.dispatcher.stop()
+    await scheduler.scheduler.stop()
+    await ws_manager.manager.shutdown()
+    hashing.shutdown()
+    await database.async_engine.dispose()
+    database.engine.dispose()
+    for async_read_engine, read_engine in zip(database.async_read_engines, database.read_engines):
+        await async_read_engine.dispose()
+        read_engine.dispose()
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
+
+# Innermost, so shed requests still get CORS headers and show up in metrics.
+app.add_middleware(
+    ratelimit.ConcurrencyLimitMiddleware,
+    max_concurrency=settings.MAX_CONCURRENT_REQUESTS,
+    max_queue=settings.MAX_QUEUED_REQUESTS,
+    queue_timeout=settings.REQUEST_QUEUE_TIMEOUT,
+    exempt_paths=["/metrics"],
+)
 app.add_middleware(
     cors.CORSMiddleware,
     allow_origins=["*"],
@@ -19,3 +52,21 @@ app.add_middleware(
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(events.router, prefix="/events", tags=["events"])
 app.include_router(websocket.router, tags=["websocket"])
+
+profiler.instrument(database.engine)
+profiler.instrument(database.async_engine.sync_engine)
+for async_read_engine, read_engine in zip(database.async_read_engines, database.read_engines):
+    profiler.instrument(read_engine, read_engine.logging_name)
+    profiler.instrument(async_read_engine.sync_engine, read_engine.logging_name)
+
+if settings.METRICS_ENABLED:
+    metrics.register_engine(database.engine, "sync")
+    metrics.register_engine(database.async_engine.sync_engine, "async")
+    for async_read_engine, read_engine in zip(database.async_read_engines, database.read_engines):
+        metrics.register_engine(read_engine, f"{read_engine.logging_name}_sync")
+        metrics.register_engine(async_read_engine.sync_engine, f"{read_engine.logging_name}_async")
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics_endpoints.router, tags=["metrics"])
+
+# Outermost, so the metrics middleware can read the request's query stats.
+app.add_middleware(profiler.ProfilerMiddleware)
@@ -1,2 +1,4 @@
 from .users import *
 from .events import *
+from .broadcasts import *
+from .outbox import *
@@ -0,0 +1,24 @@
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import orm as sa_orm
+
+from core import database
+
+
+__all__ = ["Broadcast"]
+
+
+class Broadcast(database.Base):
+    __tablename__ = 'broadcasts'
+    # Ids are sequence numbers handed to clients, so SQLite must never reuse them.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id: sa_orm.Mapped[int] = sa_orm.mapped_column(primary_key=True)
+    type: sa_orm.Mapped[str]
+    data: sa_orm.Mapped[dict] = sa_orm.mapped_column(sa.JSON)
+    topics: sa_orm.Mapped[list[str] | None] = sa_orm.mapped_column(sa.JSON)
+    created_at: sa_orm.Mapped[datetime.datetime] = sa_orm.mapped_column(server_default=sa.func.now())
+
+    def __repr__(self) -> str:
+        return f"<Broadcast(id={self.id}, type={self.type})>"
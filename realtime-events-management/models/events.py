@@ -11,6 +11,13 @@ __all__ = ["Event", "EventParticipant"]
 
 class Event(database.Base):
     __tablename__ = 'events'
+    __table_args__ = (
+        # Keyset pagination orders and seeks on (date_time, id); the filtered
+        # variants lead with the filter column so they never need a sort.
+        sa.Index('ix_events_date_time_id', 'date_time', 'id'),
+        sa.Index('ix_events_is_cancelled_date_time_id', 'is_cancelled', 'date_time', 'id'),
+        sa.Index('ix_events_organizer_id_date_time_id', 'organizer_id', 'date_time', 'id'),
+    )
 
     id: sa_orm.Mapped[int] = sa_orm.mapped_column(primary_key=True)
     title: sa_orm.Mapped[str]
@@ -19,6 +26,9 @@ class Event(database.Base):
     duration: sa_orm.Mapped[datetime.timedelta]
     address: sa_orm.Mapped[str | None]
     is_cancelled: sa_orm.Mapped[bool]
+    capacity: sa_orm.Mapped[int | None]
+    # Maintained by the join/leave statements so reads never COUNT(*).
+    participant_count: sa_orm.Mapped[int] = sa_orm.mapped_column(default=0, server_default='0')
 
     def __repr__(self) -> str:
         return f"<Event(id={self.id}, title={self.title})>"
@@ -31,8 +41,8 @@ class EventParticipant(database.Base):
     )
 
     id: sa_orm.Mapped[int] = sa_orm.mapped_column(primary_key=True)
-    event_id = sa_orm.mapped_column(sa.ForeignKey('events.id'))
-    user_id = sa_orm.mapped_column(sa.ForeignKey('users.id'))
+    event_id = sa_orm.mapped_column(sa.ForeignKey('events.id'), index=True)
+    user_id = sa_orm.mapped_column(sa.ForeignKey('users.id'), index=True)
 
     def __repr__(self) -> str:
         return f"<EventParticipant(id={self.id}, event_id={self.event_id}, user_id={self.user_id})>"
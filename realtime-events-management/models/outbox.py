@@ -0,0 +1,26 @@
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import orm as sa_orm
+
+from core import database
+
+
+__all__ = ["OutboxMessage"]
+
+
+class OutboxMessage(database.Base):
+    # Broadcasts written in the same transaction as the change they announce,
+    # deleted once a dispatcher has handed them to the WebSocket manager.
+    __tablename__ = 'outbox'
+
+    id: sa_orm.Mapped[int] = sa_orm.mapped_column(primary_key=True)
+    type: sa_orm.Mapped[str]
+    data: sa_orm.Mapped[dict] = sa_orm.mapped_column(sa.JSON)
+    topics: sa_orm.Mapped[list[str] | None] = sa_orm.mapped_column(sa.JSON)
+    created_at: sa_orm.Mapped[datetime.datetime] = sa_orm.mapped_column(server_default=sa.func.now())
+    # Set while a dispatcher works on the message; past it, another may retry.
+    locked_until: sa_orm.Mapped[datetime.datetime | None]
+
+    def __repr__(self) -> str:
+        return f"<OutboxMessage(id={self.id}, type={self.type})>"
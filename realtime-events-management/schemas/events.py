@@ -1,9 +1,47 @@
+import csv
 import datetime
+import functools
+import io
+from typing import Any, Iterable, Optional
+
+import orjson
 import pydantic
 
+from core import settings
 from schemas import users as users_schemas
 
 
+@functools.lru_cache(maxsize=1024)
+def format_duration(duration: datetime.timedelta) -> str:
+    total_minutes = int(duration.total_seconds() / 60)
+    hours = total_minutes // 60
+    minutes = total_minutes % 60
+    
+    if minutes == 0:
+        return f"{hours} hours"
+    elif hours == 0:
+        return f"{minutes} minutes"
+    else:
+        return f"{hours}:{minutes:02d} hours"
+
+
+def parse_duration(text: str) -> datetime.timedelta:
+    # Inverse of format_duration, for events received as broadcast data.
+    value, unit = text.split(" ")
+    if unit == "minutes":
+        return datetime.timedelta(minutes=int(value))
+    hours, _, minutes = value.partition(":")
+    return datetime.timedelta(hours=int(hours), minutes=int(minutes or 0))
+
+
+def format_datetime(dt: datetime.datetime) -> str:
+    # isoformat is several times faster than strftime and identical for naive
+    # datetimes with four-digit years.
+    if dt.tzinfo is None and dt.year >= 1000:
+        return dt.isoformat(sep=' ', timespec='seconds')
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
 class BaseEvent(pydantic.BaseModel):
     id: int
     title: str
@@ -11,28 +49,71 @@ class BaseEvent(pydantic.BaseModel):
     duration: datetime.timedelta
     address: str
     is_cancelled: bool
+    capacity: Optional[int] = None
+    participant_count: int = 0
 
     @pydantic.field_serializer('duration')
     def serialize_duration(self, duration: datetime.timedelta):
-        total_minutes = int(duration.total_seconds() / 60)
-        hours = total_minutes // 60
-        minutes = total_minutes % 60
-        
-        if minutes == 0:
-            return f"{hours} hours"
-        elif hours == 0:
-            return f"{minutes} minutes"
-        else:
-            return f"{hours}:{minutes:02d} hours"
+        return format_duration(duration)
 
     @pydantic.field_serializer('date_time')
     def serialize_datetime(self, dt: datetime):
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
+        return format_datetime(dt)
 
     class Config:
         from_attributes = True
 
 
+BASE_EVENT_COLUMNS = (
+    "id", "title", "date_time", "duration", "address", "is_cancelled", "capacity", "participant_count",
+)
+
+
+def dump_base_events(rows: Iterable) -> bytes:
+    # Fast path for listings: plain rows with BASE_EVENT_COLUMNS straight to
+    # JSON bytes, producing exactly what BaseEvent would.
+    return orjson.dumps([
+        {
+            "id": id,
+            "title": title,
+            "date_time": format_datetime(date_time),
+            "duration": format_duration(duration),
+            "address": address,
+            "is_cancelled": is_cancelled,
+            "capacity": capacity,
+            "participant_count": participant_count,
+        }
+        for id, title, date_time, duration, address, is_cancelled, capacity, participant_count in rows
+    ])
+
+
+EXPORT_COLUMNS = BASE_EVENT_COLUMNS + ("organizer_id",)
+
+
+def _export_record(row) -> tuple:
+    id, title, date_time, duration, address, is_cancelled, capacity, participant_count, organizer_id = row
+    return (
+        id, title, format_datetime(date_time), format_duration(duration),
+        address, is_cancelled, capacity, participant_count, organizer_id,
+    )
+
+
+def dump_export_ndjson(rows: Iterable) -> bytes:
+    return b"".join(
+        orjson.dumps(dict(zip(EXPORT_COLUMNS, _export_record(row))), option=orjson.OPT_APPEND_NEWLINE)
+        for row in rows
+    )
+
+
+def dump_export_csv(rows: Iterable, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(map(_export_record, rows))
+    return buffer.getvalue().encode()
+
+
 class EventDetail(BaseEvent):
     organizer: users_schemas.User
     participants: list[users_schemas.User]
@@ -43,6 +124,7 @@ class EventCreate(pydantic.BaseModel):
     date_time: str
     duration: int
     address: str
+    capacity: Optional[int] = pydantic.Field(default=None, ge=1)
 
     @pydantic.field_validator('date_time')
     @classmethod
@@ -56,3 +138,67 @@ class EventCreate(pydantic.BaseModel):
     @classmethod
     def validate_duration(cls, value: int):
         return datetime.timedelta(minutes=value)
+
+
+class EventListParams(pydantic.BaseModel):
+    cursor: Optional[str] = None
+    limit: int = pydantic.Field(default=settings.EVENTS_PAGE_SIZE, ge=1, le=settings.EVENTS_MAX_PAGE_SIZE)
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
+    is_cancelled: Optional[bool] = None
+    organizer_id: Optional[int] = None
+
+
+class UpcomingEventParams(pydantic.BaseModel):
+    within: int = pydantic.Field(default=3600, ge=0, le=settings.EVENTS_UPCOMING_MAX_WITHIN)
+    limit: int = pydantic.Field(default=settings.EVENTS_PAGE_SIZE, ge=1, le=settings.EVENTS_MAX_PAGE_SIZE)
+
+
+class UpcomingEvent(pydantic.BaseModel):
+    id: int
+    date_time: datetime.datetime
+
+    @pydantic.field_serializer('date_time')
+    def serialize_datetime(self, dt: datetime.datetime):
+        return format_datetime(dt)
+
+
+class BulkItemError(pydantic.BaseModel):
+    index: int
+    detail: Any
+
+
+class BulkCreateResult(pydantic.BaseModel):
+    created: list[BaseEvent]
+    errors: list[BulkItemError]
+
+
+class BatchParticipation(pydantic.BaseModel):
+    event_ids: list[int] = pydantic.Field(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+
+
+class BatchParticipationError(pydantic.BaseModel):
+    event_id: int
+    detail: str
+
+
+class BatchParticipationResult(pydantic.BaseModel):
+    succeeded: list[int]
+    errors: list[BatchParticipationError]
+
+
+def prewarm():
+    # The first validation and serialization through each model fills lazily
+    # built caches; run them at startup instead of on the first request.
+    event = EventCreate.model_validate(
+        {"title": "", "date_time": "2024-01-01 00:00:00", "duration": 60, "address": ""}
+    )
+    fields = {
+        "id": 0, "title": event.title, "date_time": event.date_time, "duration": event.duration,
+        "address": event.address, "is_cancelled": False,
+    }
+    organizer = users_schemas.User(id=0, name="")
+    EventDetail(**fields, organizer=organizer, participants=[organizer]).model_dump_json()
+    BaseEvent.model_validate(fields).model_dump(mode="json")
+    EventListParams.model_validate({"limit": "1", "date_from": "2024-01-01T00:00:00"})
+    dump_base_events([tuple(fields.get(column) for column in BASE_EVENT_COLUMNS)])
@@ -0,0 +1,19 @@
+from typing import Literal
+
+import pydantic
+
+from core import ws_manager
+
+
+class SubscriptionCommand(pydantic.BaseModel):
+    action: Literal["subscribe", "unsubscribe"]
+    topics: list[str] = []
+    event_ids: list[int] = []
+
+    @pydantic.field_validator('topics')
+    @classmethod
+    def validate_topics(cls, value: list[str]):
+        return [ws_manager.validate_topic(topic) for topic in value]
+
+    def all_topics(self) -> list[str]:
+        return self.topics + [ws_manager.event_topic(event_id) for event_id in self.event_ids]
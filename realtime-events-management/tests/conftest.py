@@ -0,0 +1,119 @@
+import httpx
+
+import pytest
+from fastapi.testclient import TestClient
+import sqlalchemy
+from sqlalchemy import orm as sa_orm
+from sqlalchemy import pool as sa_pool
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from api.endpoints import deps
+from api.endpoints import events as events_endpoints
+from core import database, metrics, outbox, profiler, scheduler
+from main import app
+
+
+DATABASE_URL = "sqlite:///./test_db.sqlite3"
+engine = sqlalchemy.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sa_orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Each TestClient request runs on its own event loop, so don't pool async connections.
+async_engine = sa_asyncio.create_async_engine(
+    database.get_async_url(DATABASE_URL), poolclass=sa_pool.NullPool
+)
+TestingAsyncSessionLocal = sa_asyncio.async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+for name, instrumented in (("sync", engine), ("async", async_engine.sync_engine)):
+    profiler.instrument(instrumented)
+    metrics.register_engine(instrumented, name)
+
+database.read_routing = database.ReadRouting(TestingSessionLocal, TestingAsyncSessionLocal)
+outbox.dispatcher.session_factory = TestingAsyncSessionLocal
+app.dependency_overrides[database.get_db] = override_get_db
+app.dependency_overrides[database.get_async_db] = override_get_async_db
+client = TestClient(app)
+
+
+@pytest.fixture
+def test_db():
+    db = next(override_get_db())
+    database.Base.metadata.create_all(bind=engine)
+    yield db
+    database.Base.metadata.drop_all(bind=engine)
+    deps.token_cache.clear()
+    deps.user_rate_limiter.clear()
+    deps.address_rate_limiter.clear()
+    scheduler.scheduler.clear()
+    events_endpoints.event_detail_cache.clear()
+
+
+@pytest.fixture
+def query_budget():
+    return profiler.query_budget
+
+
+@pytest.fixture
+def registered_user_data():
+    data = {
+        "username": "testuser",
+        "password": "testpassword",
+        "name": "Test User",
+    }
+    response = client.post("/auth/register", json=data)
+    user_id = response.json()["id"]
+    return {"id": user_id, **data}
+
+
+@pytest.fixture
+def login_data(registered_user_data: dict) -> dict:
+    return {
+        "username": registered_user_data["username"],
+        "password": registered_user_data["password"]
+    }
+
+
+@pytest.fixture
+def access_token(login_data: dict) -> str:
+    response = client.post("/auth/token", data=login_data)
+    data = response.json()
+    return data["access_token"]
+
+
+@pytest.fixture
+def request_headers(access_token: str) -> dict:
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+@pytest.fixture
+def event_data() -> dict:
+    return {
+        "title": "Test Event",
+        "date_time": "2024-10-27 13:00:00",
+        "duration": 60,
+        "address": "Test Address"
+    }
+
+
+@pytest.fixture
+def create_event_response(event_data: dict, test_db: sa_orm.Session, request_headers: dict) -> httpx.Response:
+    response = client.post(
+        "/events/create",
+        json=event_data,
+        headers=request_headers
+    )
+    return response
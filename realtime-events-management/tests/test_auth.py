@@ -0,0 +1,25 @@
+from passlib import context as passlib_context
+from sqlalchemy import orm as sa_orm
+
+from core import hashing, settings
+from models import users
+from tests.conftest import client
+
+
+def test_login_rehashes_outdated_password(monkeypatch, test_db: sa_orm.Session, registered_user_data: dict, login_data: dict):
+    monkeypatch.setattr(settings, "PASSWORD_HASH_WORKERS", 0)
+    monkeypatch.setattr(hashing, "_executor", None)
+    monkeypatch.setattr(settings, "PASSWORD_HASH_ROUNDS", 6000)
+    monkeypatch.setattr(hashing, "pwd_context", passlib_context.CryptContext(**hashing.get_context_options()))
+    user = test_db.get(users.User, registered_user_data["id"])
+    user.password = passlib_context.CryptContext(schemes=["sha256_crypt"]).hash(
+        login_data["password"], rounds=5000
+    )
+    test_db.commit()
+
+    response = client.post("/auth/token", data=login_data)
+    assert response.status_code == 200
+    test_db.refresh(user)
+    assert "rounds=6000" in user.password
+    assert client.post("/auth/token", data=login_data).status_code == 200
+    assert client.post("/auth/token", data={**login_data, "password": "wrong"}).status_code == 401
@@ -0,0 +1,37 @@
+import time
+
+from core import cache, versions
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    lru = cache.TTLCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    ttl_cache = cache.TTLCache(maxsize=10, ttl=60)
+    ttl_cache.set("short", 1, ttl=0.01)
+    ttl_cache.set("expired", 1, ttl=-1)
+    time.sleep(0.02)
+    assert ttl_cache.get("short") is None
+    assert ttl_cache.get("expired") is None
+    assert ttl_cache.stats()["misses"] == 2
+
+
+def test_versions_never_match_after_an_event_is_forgotten():
+    event_versions = versions.Versions(maxsize=1)
+    untouched = event_versions.etag(event_versions.event(1)[0])
+    event_versions.bump([1])
+    changed = event_versions.etag(event_versions.event(1)[0])
+    assert changed != untouched
+    # Forgetting event 1 must not take it back to an earlier tag.
+    event_versions.bump([2])
+    assert event_versions.etag(event_versions.event(1)[0]) not in (untouched, changed)
+    assert versions.etag_matches("*", changed)
+    assert not versions.etag_matches(None, changed)
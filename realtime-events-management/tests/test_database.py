@@ -0,0 +1,84 @@
+import pytest
+import sqlalchemy
+from sqlalchemy import orm as sa_orm
+from sqlalchemy import pool as sa_pool
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from core import database, profiler
+from tests.conftest import TestingAsyncSessionLocal, TestingSessionLocal, client, engine
+
+
+def test_prepare_schema_verifies_tables_columns_and_indexes(monkeypatch, test_db: sa_orm.Session):
+    monkeypatch.setattr(database, "engine", engine)
+    database.prepare_schema("verify")
+
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DROP TABLE broadcasts"))
+        connection.execute(sqlalchemy.text("ALTER TABLE events DROP COLUMN capacity"))
+        connection.execute(sqlalchemy.text("DROP INDEX ix_events_date_time_id"))
+    with pytest.raises(RuntimeError, match="missing: broadcasts, events.capacity, ix_events_date_time_id"):
+        database.prepare_schema("verify")
+    database.prepare_schema("create")
+    database.prepare_schema("verify")
+    with engine.connect() as connection:
+        indexes = {index["name"] for index in sqlalchemy.inspect(connection).get_indexes("events")}
+    assert "ix_events_date_time_id" in indexes
+    with pytest.raises(ValueError):
+        database.prepare_schema("migrate")
+
+
+def test_create_adds_participant_counts_to_events_from_before_them(
+    monkeypatch, test_db: sa_orm.Session, create_event_response, request_headers: dict
+):
+    monkeypatch.setattr(database, "engine", engine)
+    event_id = create_event_response.json()["id"]
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("ALTER TABLE events DROP COLUMN participant_count"))
+        connection.execute(sqlalchemy.text("ALTER TABLE events DROP COLUMN capacity"))
+        connection.execute(sqlalchemy.text(
+            f"INSERT INTO event_participants (event_id, user_id) VALUES ({event_id}, 1)"
+        ))
+
+    database.prepare_schema("create")
+    detail = client.get(f"/events/{event_id}").json()
+    assert detail["participant_count"] == 1 and detail["capacity"] is None
+    assert client.post(f"/events/{event_id}/leave", headers=request_headers).status_code == 200
+    assert client.get(f"/events/{event_id}").json()["participant_count"] == 0
+
+
+def test_reads_go_to_replicas_except_after_own_writes(
+    monkeypatch, tmp_path, test_db: sa_orm.Session, create_event_response, request_headers: dict
+):
+    # An empty replica stands in for one lagging behind the primary.
+    replica_url = f"sqlite:///{tmp_path}/replica.sqlite3"
+    replica_engine = sqlalchemy.create_engine(replica_url)
+    async_replica_engine = sa_asyncio.create_async_engine(
+        database.get_async_url(replica_url), poolclass=sa_pool.NullPool
+    )
+    database.Base.metadata.create_all(bind=replica_engine)
+    profiler.instrument(replica_engine, "replica1")
+    profiler.instrument(async_replica_engine.sync_engine, "replica1")
+    monkeypatch.setattr(database, "read_routing", database.ReadRouting(
+        TestingSessionLocal,
+        TestingAsyncSessionLocal,
+        [sa_orm.sessionmaker(bind=replica_engine, info={"replica": True})],
+        [sa_asyncio.async_sessionmaker(bind=async_replica_engine, info={"replica": True})],
+    ))
+    event_id = create_event_response.json()["id"]
+
+    with profiler.query_budget(10) as stats:
+        assert client.get(f"/events/{event_id}").status_code == 404
+        assert client.get("/events/").json() == []
+        assert client.get("/events/export").text == ""
+    assert set(stats.engines) == {"replica1"}
+
+    assert client.post(f"/events/{event_id}/join", headers=request_headers).status_code == 200
+    with profiler.query_budget(10) as stats:
+        response = client.get(f"/events/{event_id}", headers=request_headers)
+    assert response.json()["participant_count"] == 1
+    assert set(stats.engines) == {"primary"}
+    # Everyone else still reads from the replica, though the detail the
+    # writer read from the primary is now cached for all.
+    assert client.get("/events/").json() == []
+    assert client.get(f"/events/{event_id}").json()["participant_count"] == 1
+    replica_engine.dispose()
@@ -1,90 +1,16 @@
 import datetime
+import json
 import httpx
 
 import pytest
-from fastapi.testclient import TestClient
-import sqlalchemy
 from sqlalchemy import orm as sa_orm
 
-from core import database
-from main import app
+from api.endpoints import deps
+from api.endpoints import events as events_endpoints
+from core import settings
 from models import users, events
-
-
-DATABASE_URL = "sqlite:///./test_db.sqlite3"
-engine = sqlalchemy.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sa_orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-app.dependency_overrides[database.get_db] = override_get_db
-client = TestClient(app)
-
-
-@pytest.fixture
-def test_db():
-    db = next(override_get_db())
-    database.Base.metadata.create_all(bind=engine)
-    yield db
-    database.Base.metadata.drop_all(bind=engine)
-
-
-@pytest.fixture
-def registered_user_data():
-    data = {
-        "username": "testuser",
-        "password": "testpassword",
-        "name": "Test User",
-    }
-    response = client.post("/auth/register", json=data)
-    user_id = response.json()["id"]
-    return {"id": user_id, **data}
-
-
-@pytest.fixture
-def login_data(registered_user_data: dict) -> dict:
-    return {
-        "username": registered_user_data["username"],
-        "password": registered_user_data["password"]
-    }
-
-
-@pytest.fixture
-def access_token(login_data: dict) -> str:
-    response = client.post("/auth/token", data=login_data)
-    data = response.json()
-    return data["access_token"]
-
-
-@pytest.fixture
-def request_headers(access_token: str) -> dict:
-    return {"Authorization": f"Bearer {access_token}"}
-
-
-@pytest.fixture
-def event_data() -> dict:
-    return {
-        "title": "Test Event",
-        "date_time": "2024-10-27 13:00:00",
-        "duration": 60,
-        "address": "Test Address"
-    }
-
-
-@pytest.fixture
-def create_event_response(event_data: dict, test_db: sa_orm.Session, request_headers: dict) -> httpx.Response:
-    response = client.post(
-        "/events/create",
-        json=event_data,
-        headers=request_headers
-    )
-    return response
+from schemas import events as events_schemas
+from tests.conftest import client, engine
 
 
 def test_create_event(event_data: dict, test_db: sa_orm.Session, create_event_response: httpx.Response):
@@ -144,3 +70,265 @@ def test_join_event(test_db: sa_orm.Session, request_headers: dict, registered_u
         events.EventParticipant.user_id == registered_user_data["id"]
     ).all()
     assert len(event_participants) == 1
+
+
+def test_leave_event(test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    leave_before_join_response = client.post(f"/events/{event_id}/leave", headers=request_headers)
+    assert leave_before_join_response.status_code == 400
+    client.post(f"/events/{event_id}/join", headers=request_headers)
+    leave_event_response = client.post(f"/events/{event_id}/leave", headers=request_headers)
+    assert leave_event_response.status_code == 200
+    assert test_db.query(events.EventParticipant).filter(
+        events.EventParticipant.event_id == event_id
+    ).count() == 0
+
+
+def test_get_events_paginates_with_cursor(test_db: sa_orm.Session, request_headers: dict, event_data: dict):
+    for day in (29, 27, 28):
+        client.post(
+            "/events/create",
+            json={**event_data, "date_time": f"2024-10-{day} 13:00:00"},
+            headers=request_headers
+        )
+    first_page = client.get("/events/", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert [event["date_time"] for event in first_page.json()] == ["2024-10-27 13:00:00", "2024-10-28 13:00:00"]
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = client.get("/events/", params={"limit": 2, "cursor": cursor})
+    assert [event["date_time"] for event in second_page.json()] == ["2024-10-29 13:00:00"]
+    assert "X-Next-Cursor" not in second_page.headers
+    filtered = client.get("/events/", params={"date_from": "2024-10-28 00:00:00", "is_cancelled": False})
+    assert len(filtered.json()) == 2
+    assert client.get("/events/", params={"cursor": "invalid"}).status_code == 400
+
+
+@pytest.mark.parametrize("filters, index", [
+    ({}, "ix_events_date_time_id"),
+    ({"is_cancelled": False}, "ix_events_is_cancelled_date_time_id"),
+    ({"organizer_id": 1}, "ix_events_organizer_id_date_time_id"),
+])
+def test_get_events_query_uses_index(test_db: sa_orm.Session, filters: dict, index: str):
+    params = events_schemas.EventListParams(
+        cursor=events_endpoints.encode_cursor(datetime.datetime(2024, 10, 27, 13), 1),
+        **filters
+    )
+    compiled = events_endpoints.build_events_query(params).compile(engine)
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {compiled}", tuple(compiled.params[name] for name in compiled.positiontup)
+        ).all()
+    details = " ".join(row[-1] for row in plan)
+    assert f"USING INDEX {index}" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_current_user_is_cached_until_user_changes(test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    hits = deps.token_cache.hits
+    client.post(f"/events/{event_id}/join", headers=request_headers)
+    assert deps.token_cache.hits == hits + 1
+
+    user = test_db.query(users.User).one()
+    user.name = "Renamed User"
+    test_db.commit()
+    assert len(deps.token_cache) == 0
+    client.post(f"/events/{event_id}/leave", headers=request_headers)
+    assert deps.token_cache.get(request_headers["Authorization"].split()[1])[1].name == "Renamed User"
+
+
+def test_get_event_is_cached_until_event_changes(test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    hits = events_endpoints.event_detail_cache.hits
+    first = client.get(f"/events/{event_id}")
+    second = client.get(f"/events/{event_id}")
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert first.json()["participants"] == []
+    assert events_endpoints.event_detail_cache.hits == hits + 1
+
+    client.post(f"/events/{event_id}/join", headers=request_headers)
+    participants = client.get(f"/events/{event_id}").json()["participants"]
+    assert participants == [{"id": 1, "name": "Test User"}]
+    assert client.get("/events/404").status_code == 404
+
+
+def test_get_event_cache_survives_user_updates_except_renames(test_db: sa_orm.Session, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    client.get(f"/events/{event_id}")
+    version = events_endpoints.event_versions.catalogue()
+
+    user = test_db.query(users.User).one()
+    user.password = "rehashed"
+    test_db.commit()
+    assert events_endpoints.event_detail_cache.get(event_id) is not None
+    assert events_endpoints.event_versions.catalogue() == version
+
+    user.name = "Renamed User"
+    test_db.commit()
+    assert events_endpoints.event_detail_cache.get(event_id) is None
+    assert client.get(f"/events/{event_id}").json()["organizer"]["name"] == "Renamed User"
+
+
+def test_export_events_streams_ndjson_and_csv(test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    client.post(f"/events/{event_id}/join", headers=request_headers)
+
+    ndjson_response = client.get("/events/export")
+    assert ndjson_response.status_code == 200
+    assert ndjson_response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in ndjson_response.text.splitlines()]
+    assert records == [{
+        "id": event_id,
+        "title": "Test Event",
+        "date_time": "2024-10-27 13:00:00",
+        "duration": "1 hours",
+        "address": "Test Address",
+        "is_cancelled": False,
+        "capacity": None,
+        "participant_count": 1,
+        "organizer_id": 1,
+    }]
+
+    csv_response = client.get("/events/export", params={"format": "csv"})
+    assert csv_response.text.splitlines() == [
+        "id,title,date_time,duration,address,is_cancelled,capacity,participant_count,organizer_id",
+        f"{event_id},Test Event,2024-10-27 13:00:00,1 hours,Test Address,False,,1,1",
+    ]
+
+
+def test_bulk_create_events_reports_per_item_errors(test_db: sa_orm.Session, request_headers: dict, event_data: dict):
+    with client.websocket_connect("/ws") as websocket:
+        response = client.post(
+            "/events/bulk",
+            json=[event_data, {**event_data, "date_time": "tomorrow"}, {**event_data, "title": "Second"}],
+            headers=request_headers
+        )
+        message = websocket.receive_json()
+    assert response.status_code == 200
+    data = response.json()
+    assert [event["title"] for event in data["created"]] == ["Test Event", "Second"]
+    assert [error["index"] for error in data["errors"]] == [1]
+    assert message["type"] == "events_created"
+    assert message["data"]["events"] == data["created"]
+    assert test_db.query(events.Event).count() == 2
+
+
+def test_bulk_join_and_leave_events(test_db: sa_orm.Session, request_headers: dict, event_data: dict):
+    created = client.post("/events/bulk", json=[event_data, event_data], headers=request_headers).json()["created"]
+    first_id, second_id = (event["id"] for event in created)
+    client.post(f"/events/{first_id}/join", headers=request_headers)
+
+    with client.websocket_connect("/ws") as websocket:
+        join_response = client.post(
+            "/events/bulk/join", json={"event_ids": [first_id, second_id, 404]}, headers=request_headers
+        )
+        message = websocket.receive_json()
+    assert join_response.json() == {
+        "succeeded": [second_id],
+        "errors": [
+            {"event_id": first_id, "detail": "You have already joined the event"},
+            {"event_id": 404, "detail": "Event not found"},
+        ],
+    }
+    assert message["type"] == "participants_changed"
+    assert message["data"] == {"events": [{"id": second_id, "joined": [{"id": 1, "name": "Test User"}], "left": []}]}
+
+    leave_response = client.post(
+        "/events/bulk/leave", json={"event_ids": [first_id, second_id]}, headers=request_headers
+    )
+    assert leave_response.json() == {"succeeded": [first_id, second_id], "errors": []}
+    assert test_db.query(events.EventParticipant).count() == 0
+
+
+def test_join_respects_capacity_and_tracks_participant_count(test_db: sa_orm.Session, request_headers: dict, event_data: dict):
+    event_id = client.post("/events/create", json={**event_data, "capacity": 1}, headers=request_headers).json()["id"]
+    other = {"username": "other", "password": "other-password"}
+    client.post("/auth/register", json={**other, "name": "Other User"})
+    other_token = client.post("/auth/token", data=other).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {other_token}"}
+
+    assert client.post(f"/events/{event_id}/join", headers=request_headers).status_code == 200
+    assert client.post(f"/events/{event_id}/join", headers=request_headers).status_code == 400
+    response = client.post(f"/events/{event_id}/join", headers=other_headers)
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Event is full"
+    assert client.get(f"/events/{event_id}").json()["participant_count"] == 1
+
+    assert client.post(f"/events/{event_id}/leave", headers=request_headers).status_code == 200
+    assert client.post(f"/events/{event_id}/leave", headers=request_headers).status_code == 400
+    assert client.post(f"/events/{event_id}/join", headers=other_headers).status_code == 200
+    event = test_db.get(events.Event, event_id)
+    test_db.refresh(event)
+    assert event.participant_count == 1
+
+
+def test_endpoints_stay_within_query_budgets(test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response, query_budget):
+    event_id = create_event_response.json()["id"]
+    deps.token_cache.clear()
+    # Writes also insert an outbox message; after the response it is deleted
+    # once sent, and the dispatcher polls for expired ones.
+    with query_budget(6):  # current user, count update, participant insert, outbox
+        client.post(f"/events/{event_id}/join", headers=request_headers)
+    with query_budget(5):  # token cached; count update, participant delete, outbox
+        client.post(f"/events/{event_id}/leave", headers=request_headers)
+    with query_budget(2):  # event with organizer, participants
+        client.get(f"/events/{event_id}")
+    with query_budget(0):
+        client.get(f"/events/{event_id}")
+    with query_budget(1):
+        client.get("/events/")
+
+
+@pytest.fixture
+def etags(monkeypatch):
+    monkeypatch.setattr(settings, "EVENT_ETAGS", True)
+
+
+def test_event_reads_carry_no_etags_unless_enabled(test_db: sa_orm.Session, create_event_response: httpx.Response):
+    # Tests use the memory backend, which would leave other workers' tags stale.
+    event_id = create_event_response.json()["id"]
+    assert "etag" not in client.get(f"/events/{event_id}").headers
+    assert "etag" not in client.get("/events/").headers
+    assert client.get(f"/events/{event_id}", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_event_reads_answer_not_modified_until_something_changes(
+    etags, test_db: sa_orm.Session, request_headers: dict, event_data: dict, create_event_response: httpx.Response, query_budget
+):
+    event_id = create_event_response.json()["id"]
+    detail = client.get(f"/events/{event_id}")
+    listing = client.get("/events/")
+    detail_tag, listing_tag = detail.headers["etag"], listing.headers["etag"]
+
+    with query_budget(0):
+        response = client.get(f"/events/{event_id}", headers={"If-None-Match": detail_tag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == detail_tag
+        response = client.get("/events/", headers={"If-None-Match": f'"other", W/{listing_tag}'})
+        assert response.status_code == 304
+
+    client.post(f"/events/{event_id}/join", headers=request_headers)
+    response = client.get(f"/events/{event_id}", headers={"If-None-Match": detail_tag})
+    assert response.status_code == 200
+    assert response.json()["participant_count"] == 1
+    listing_tag = client.get("/events/", headers={"If-None-Match": listing_tag}).headers["etag"]
+
+    # A new event changes the listing but not the details of others.
+    client.post("/events/create", json=event_data, headers=request_headers)
+    assert client.get("/events/", headers={"If-None-Match": listing_tag}).status_code == 200
+    detail_tag = client.get(f"/events/{event_id}").headers["etag"]
+    assert client.get(f"/events/{event_id}", headers={"If-None-Match": detail_tag}).status_code == 304
+
+
+def test_conditional_reads_of_missing_events_are_not_found(
+    etags, test_db: sa_orm.Session, create_event_response: httpx.Response
+):
+    event_id = create_event_response.json()["id"]
+    assert client.get(f"/events/{event_id}", headers={"If-None-Match": "*"}).status_code == 304
+    # The tag the missing event's version would have.
+    version_tag = events_endpoints.event_versions.etag(events_endpoints.event_versions.event(404)[0])
+    for if_none_match in ("*", version_tag):
+        response = client.get("/events/404", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 404
@@ -0,0 +1,55 @@
+import httpx
+from sqlalchemy import orm as sa_orm
+
+from core import metrics, pubsub, ws_manager
+from tests.conftest import client
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, '/a"b')
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a\\"b",le="1"} 3',
+        'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a\\"b"} 3.65',
+        'latency_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def test_metrics_endpoint_reports_routes_queries_and_pools(test_db: sa_orm.Session, create_event_response: httpx.Response):
+    event_id = create_event_response.json()["id"]
+    route_queries = lambda: metrics.DB_QUERIES.values.get(("GET", "/events/{event_id}", "primary"), 0)
+    queries_before = route_queries()
+    client.get(f"/events/{event_id}")
+    client.get("/nowhere")
+    assert route_queries() > queries_before
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="/events/{event_id}",status="200"}') for line in lines)
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}') for line in lines)
+    assert any(line.startswith('db_queries_total{method="POST",route="/events/create",engine="primary"}') for line in lines)
+    assert any(line.startswith('db_pool_checkedout{engine="sync"}') for line in lines)
+    assert "# TYPE ws_active_connections gauge" in lines
+    assert "# TYPE cache_hits_total counter" in lines
+    assert any(line.startswith('cache_misses_total{cache="event_detail"}') for line in lines)
+    assert any(line.startswith('cache_hit_rate{cache="token"}') for line in lines)
+
+
+def test_metrics_endpoint_reports_broadcast_bus_stats(monkeypatch):
+    backend = pubsub.UnixSocketBackend()
+    backend.sent, backend.dropped = 3, 1
+    backend.latency.record(0.002)
+    monkeypatch.setattr(ws_manager.manager, "backend", backend)
+
+    lines = client.get("/metrics").text.splitlines()
+    assert "broadcast_bus_sent_total 3" in lines
+    assert "broadcast_bus_dropped_total 1" in lines
+    assert "broadcast_bus_errors_total 0" in lines
+    assert 'broadcast_bus_delivery_latency_seconds{quantile="0.99"} 0.002' in lines
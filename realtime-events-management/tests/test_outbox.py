@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+from sqlalchemy import orm as sa_orm
+from sqlalchemy.sql import expression
+
+from core import outbox, ws_manager
+from models import outbox as outbox_models
+from tests.conftest import TestingAsyncSessionLocal, client
+from tests.test_ws_manager import FakeWebSocket
+
+
+def test_failed_dispatch_is_retried_after_the_lease(
+    monkeypatch, test_db: sa_orm.Session, request_headers: dict, create_event_response: httpx.Response
+):
+    event_id = create_event_response.json()["id"]
+    sent = []
+
+    async def failing_broadcast(type, data, topics=None):
+        raise ConnectionError("bus down")
+
+    async def recording_broadcast(type, data, topics=None):
+        sent.append((type, data, topics))
+
+    monkeypatch.setattr(ws_manager.manager, "broadcast", failing_broadcast)
+    assert client.post(f"/events/{event_id}/join", headers=request_headers).status_code == 200
+    # Nothing for a write that did not commit.
+    assert client.post("/events/404/join", headers=request_headers).status_code == 404
+    message = test_db.scalars(expression.select(outbox_models.OutboxMessage)).one()
+    assert message.type == "joined_event" and message.locked_until is not None
+
+    monkeypatch.setattr(ws_manager.manager, "broadcast", recording_broadcast)
+    asyncio.run(outbox.dispatcher.drain())
+    assert sent == []  # still leased
+    test_db.execute(expression.update(outbox_models.OutboxMessage).values(
+        locked_until=datetime.datetime.now() - datetime.timedelta(seconds=1)
+    ))
+    test_db.commit()
+    asyncio.run(outbox.dispatcher.drain())
+    assert sent == [(
+        "joined_event",
+        {"id": event_id, "participant": {"id": 1, "name": "Test User"}},
+        [f"event:{event_id}"],
+    )]
+    test_db.expire_all()
+    assert test_db.scalars(expression.select(outbox_models.OutboxMessage)).all() == []
+
+
+def test_dispatcher_sends_on_wake_and_polls_for_leftovers(test_db: sa_orm.Session):
+    async def scenario():
+        manager = ws_manager.ConnectionManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        dispatcher = outbox.OutboxDispatcher(manager, TestingAsyncSessionLocal, batch_size=2, poll_interval=0.2)
+        await dispatcher.start()
+
+        async with TestingAsyncSessionLocal() as db:
+            rows = [outbox.add(db, "event_canceled", {"id": index}, topics=["events"]) for index in range(3)]
+            await db.commit()
+            dispatcher.enqueue(rows)
+        assert dispatcher.wake()
+        await asyncio.sleep(0.1)
+        woken = len(websocket.sent)
+
+        # As if written by a process that died before sending it.
+        async with TestingAsyncSessionLocal() as db:
+            db.add(outbox_models.OutboxMessage(type="event_canceled", data={"id": 3}, topics=["events"]))
+            await db.commit()
+        await asyncio.sleep(0.3)
+        await dispatcher.stop()
+        await manager.stop()
+        return woken, [json.loads(frame)["data"]["id"] for frame in websocket.sent]
+
+    woken, sent = asyncio.run(scenario())
+    assert woken == 3
+    assert sent == [0, 1, 2, 3]
+    assert test_db.scalars(expression.select(outbox_models.OutboxMessage)).all() == []
+
+
+def test_joins_within_one_coalescing_window_leave_as_one_frame(test_db: sa_orm.Session):
+    async def scenario():
+        manager = ws_manager.ConnectionManager(coalesce_window=0.5)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        dispatcher = outbox.OutboxDispatcher(manager, TestingAsyncSessionLocal, poll_interval=60)
+        await dispatcher.start()
+
+        for user_id in range(1, 6):
+            async with TestingAsyncSessionLocal() as db:
+                row = outbox.add(
+                    db,
+                    "joined_event",
+                    {"id": 7, "participant": {"id": user_id, "name": f"User {user_id}"}},
+                    topics=["event:7"],
+                )
+                await db.commit()
+                dispatcher.enqueue([row])
+            assert dispatcher.wake()
+            await asyncio.sleep(0.005)
+        # Not deleted before the window's flush published them.
+        await dispatcher.poll()
+        async with TestingAsyncSessionLocal() as db:
+            kept = len((await db.scalars(expression.select(outbox_models.OutboxMessage))).all())
+        await asyncio.sleep(0.6)
+        await dispatcher.poll()
+        await dispatcher.stop()
+        await manager.stop()
+        return kept, [json.loads(frame) for frame in websocket.sent]
+
+    kept, frames = asyncio.run(scenario())
+    assert kept == 5
+    assert [frame["type"] for frame in frames] == ["participants_changed"]
+    assert [participant["id"] for participant in frames[0]["data"]["events"][0]["joined"]] == [1, 2, 3, 4, 5]
+    assert test_db.scalars(expression.select(outbox_models.OutboxMessage)).all() == []
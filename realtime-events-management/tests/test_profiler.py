@@ -0,0 +1,33 @@
+import httpx
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import orm as sa_orm
+
+from core import profiler, settings
+from tests.conftest import client, engine
+
+
+def test_query_budget_fails_with_statements(test_db: sa_orm.Session):
+    with pytest.raises(AssertionError, match="1 queries over a budget of 0:\nSELECT events.id"):
+        with profiler.query_budget(0):
+            client.get("/events/")
+
+
+def test_failed_statements_do_not_skew_the_next_timing(test_db: sa_orm.Session):
+    with engine.connect() as connection:
+        with pytest.raises(sa.exc.OperationalError):
+            connection.execute(sa.text("SELECT * FROM missing_table"))
+        assert connection.info["query_started"] == []
+        with profiler.query_budget(1) as stats:
+            connection.execute(sa.text("SELECT 1"))
+        assert stats.count == 1 and connection.info["query_started"] == []
+
+
+def test_development_responses_carry_query_stats(monkeypatch, test_db: sa_orm.Session, create_event_response: httpx.Response):
+    monkeypatch.setattr(settings, "DEVELOPMENT", True)
+    response = client.get("/events/")
+    assert response.headers["x-db-query-count"] == "1"
+    assert float(response.headers["x-db-time-ms"]) > 0
+
+    monkeypatch.setattr(settings, "DEVELOPMENT", False)
+    assert "x-db-query-count" not in client.get("/events/").headers
@@ -0,0 +1,86 @@
+import asyncio
+import socket
+
+from core import pubsub
+
+
+def test_unix_backend_relays_messages_between_workers(tmp_path):
+    async def scenario():
+        received = {"a": [], "b": []}
+        worker_a = pubsub.UnixSocketBackend(directory=str(tmp_path))
+        worker_b = pubsub.UnixSocketBackend(directory=str(tmp_path))
+        await worker_a.start(received["a"].append)
+        await worker_b.start(received["b"].append)
+        message = {"type": "event_created", "data": {"id": 1}, "topics": ["events"]}
+        await worker_a.publish(message)
+        await asyncio.sleep(0.05)
+        await worker_a.stop()
+        await worker_b.stop()
+        return received, worker_b.stats()
+
+    received, stats = asyncio.run(scenario())
+    assert received["a"] == received["b"] == [{"type": "event_created", "data": {"id": 1}, "topics": ["events"]}]
+    assert stats["delivery_latency"]["count"] == 1
+
+
+def test_unix_backend_removes_sockets_of_dead_workers(tmp_path):
+    stale_path = tmp_path / "stale.sock"
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stale.bind(str(stale_path))
+    stale.close()
+
+    async def scenario():
+        worker = pubsub.UnixSocketBackend(directory=str(tmp_path))
+        await worker.start(lambda message: None)
+        await worker.publish({"type": "event_created", "data": {"id": 1}, "topics": None})
+        await worker.stop()
+
+    asyncio.run(scenario())
+    assert not stale_path.exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unix_backend_splits_large_messages_and_survives_bad_datagrams(tmp_path):
+    async def scenario():
+        received = []
+        worker_a = pubsub.UnixSocketBackend(directory=str(tmp_path), max_datagram_size=1024)
+        worker_b = pubsub.UnixSocketBackend(directory=str(tmp_path), max_datagram_size=1024)
+        await worker_a.start(lambda message: None)
+        await worker_b.start(received.append)
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.sendto(b"garbage", str(worker_b.path))
+        sender.sendto(pubsub.CHUNK_HEADER.pack(b"x" * 16, 0, 1) + b"{not json", str(worker_b.path))
+        sender.close()
+        events = [{"id": index, "title": "x" * 100} for index in range(5000)]
+        await worker_a.publish({"type": "events_created", "data": {"events": events}, "topics": ["events"]})
+        await worker_a.publish({"type": "event_canceled", "data": {"id": 1}, "topics": None})
+        await asyncio.sleep(0.2)
+        await worker_a.stop()
+        await worker_b.stop()
+        return received, worker_b.stats()
+
+    received, stats = asyncio.run(scenario())
+    assert [message["type"] for message in received] == ["events_created", "event_canceled"]
+    assert len(received[0]["data"]["events"]) == 5000
+    assert stats["errors"] == 2
+
+
+def test_unix_backend_raises_when_a_peer_is_not_sent_the_message(tmp_path):
+    # A peer that never reads fills up and then times out.
+    stuck_path = tmp_path / "stuck.sock"
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stuck.bind(str(stuck_path))
+
+    async def scenario():
+        worker = pubsub.UnixSocketBackend(directory=str(tmp_path), max_datagram_size=1024, send_timeout=0.05)
+        await worker.start(lambda message: None)
+        try:
+            await worker.publish({"type": "event_created", "data": {"id": 1, "title": "x" * 10_000_000}, "topics": None})
+        except ConnectionError:
+            return worker.stats()
+        finally:
+            await worker.stop()
+
+    stats = asyncio.run(scenario())
+    stuck.close()
+    assert stats["dropped"] == 1
@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+from sqlalchemy import orm as sa_orm
+
+from api.endpoints import deps
+from core import metrics, ratelimit, ws_manager
+from tests.conftest import client
+from tests.test_ws_manager import FakeWebSocket
+
+
+def test_rate_limiter_refills_per_key(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    limiter = ratelimit.RateLimiter(rate=2, burst=2, maxsize=2)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0.5
+    assert limiter.acquire("b") == 0
+    now[0] += 0.5
+    assert limiter.acquire("a") == 0
+    # Least recently used keys are forgotten past maxsize.
+    limiter.acquire("c")
+    assert len(limiter) == 2
+    assert ratelimit.RateLimiter(rate=0, burst=0).acquire("a") == 0
+
+
+def test_write_endpoints_are_throttled_per_user(
+    monkeypatch, test_db: sa_orm.Session, create_event_response: httpx.Response, request_headers: dict
+):
+    monkeypatch.setattr(deps, "user_rate_limiter", ratelimit.RateLimiter(rate=0.01, burst=2))
+    event_id = create_event_response.json()["id"]
+    throttled_before = metrics.HTTP_REQUESTS_THROTTLED.values.get(("user",), 0)
+    assert client.post(f"/events/{event_id}/join", headers=request_headers).status_code == 200
+    assert client.post(f"/events/{event_id}/leave", headers=request_headers).status_code == 200
+    response = client.post(f"/events/{event_id}/join", headers=request_headers)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    assert metrics.HTTP_REQUESTS_THROTTLED.values[("user",)] == throttled_before + 1
+    # Reads are not limited.
+    assert client.get(f"/events/{event_id}").status_code == 200
+
+
+def test_login_is_throttled_per_address(monkeypatch, test_db: sa_orm.Session, login_data: dict):
+    monkeypatch.setattr(deps, "address_rate_limiter", ratelimit.RateLimiter(rate=0.01, burst=1))
+    assert client.post("/auth/token", data=login_data).status_code == 200
+    assert client.post("/auth/token", data=login_data).status_code == 429
+
+
+def test_concurrency_limit_queues_then_sheds():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        limited = ratelimit.ConcurrencyLimitMiddleware(app, max_concurrency=1, max_queue=1, queue_timeout=0.05)
+
+        async def call():
+            statuses = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+
+            await limited({"type": "http", "path": "/"}, None, send)
+            return statuses[0]
+
+        running = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        # The queue is full, so this one is refused without waiting.
+        assert await call() == 503
+        # The queued request gives up after queue_timeout.
+        assert await queued == 503
+        queued = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        release.set()
+        # A finishing request hands its slot to the next one in line.
+        assert await running == 200
+        assert await queued == 200
+        assert limited.active == 0 and not limited.waiters
+
+    asyncio.run(scenario())
+
+
+def test_websocket_accept_rate():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(accept_rate=0.01, accept_burst=2)
+        websockets = [FakeWebSocket() for _ in range(3)]
+        accepted = [await manager.connect(websocket) for websocket in websockets]
+        await manager.stop()
+        return accepted, websockets[2].close_code
+
+    accepted, close_code = asyncio.run(scenario())
+    assert accepted == [True, True, False]
+    assert close_code == 1013
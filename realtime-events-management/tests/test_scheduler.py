@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+from sqlalchemy import orm as sa_orm
+
+from core import scheduler, ws_manager
+from tests.conftest import TestingAsyncSessionLocal, client
+from tests.test_ws_manager import FakeWebSocket
+
+NOW = datetime.datetime(2030, 1, 1, 12)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = NOW
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+
+def test_scheduler_notifies_starts_and_ends():
+    async def scenario():
+        manager = ws_manager.ConnectionManager()
+        everything, one_event = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(everything)
+        await manager.connect(one_event, topics=["event:2"])
+        clock = Clock()
+        index = scheduler.EventScheduler(manager, clock=clock)
+        index.add(1, NOW + datetime.timedelta(minutes=5), datetime.timedelta(minutes=30))
+        index.add(2, NOW + datetime.timedelta(minutes=10), datetime.timedelta(minutes=5))
+        index.add(3, NOW + datetime.timedelta(minutes=1), datetime.timedelta(hours=1))
+        # Already over, so never scheduled.
+        index.add(4, NOW - datetime.timedelta(hours=2), datetime.timedelta(hours=1))
+        index.cancel(3)
+
+        # Cancelled keys are dropped lazily, so the next wake-up is still at 3.
+        assert index.tick() == 60
+        assert index.upcoming(600, 10) == [
+            (1, NOW + datetime.timedelta(minutes=5)), (2, NOW + datetime.timedelta(minutes=10)),
+        ]
+        assert index.upcoming(600, 1) == [(1, NOW + datetime.timedelta(minutes=5))]
+
+        clock.now = NOW + datetime.timedelta(minutes=15)
+        index.tick()
+        clock.now = NOW + datetime.timedelta(hours=2)
+        assert index.tick() is None
+        await asyncio.sleep(0.01)
+        await manager.stop()
+        assert index.stats() == {"starts": 0, "ends": 0, "cancelled": 0, "bytes": 0}
+        return [json.loads(frame) for frame in everything.sent], [json.loads(frame) for frame in one_event.sent]
+
+    everything, one_event = asyncio.run(scenario())
+    assert everything == [
+        {"type": "event_starting", "data": {"id": 1}},
+        {"type": "event_starting", "data": {"id": 2}},
+        {"type": "event_ended", "data": {"id": 2}},
+        {"type": "event_ended", "data": {"id": 1}},
+    ]
+    assert one_event == [
+        {"type": "event_starting", "data": {"id": 2}},
+        {"type": "event_ended", "data": {"id": 2}},
+    ]
+
+
+def test_upcoming_follows_created_and_cancelled_events(
+    test_db: sa_orm.Session, event_data: dict, request_headers: dict
+):
+    starts_at = (datetime.datetime.now() + datetime.timedelta(minutes=30)).replace(microsecond=0)
+    event_data = {**event_data, "date_time": starts_at.strftime("%Y-%m-%d %H:%M:%S")}
+    event_id = client.post("/events/create", json=event_data, headers=request_headers).json()["id"]
+    client.post("/events/create", json={**event_data, "date_time": "2024-01-01 10:00:00"}, headers=request_headers)
+
+    response = client.get("/events/upcoming", params={"within": 3600})
+    assert response.status_code == 200
+    assert response.json() == [{"id": event_id, "date_time": event_data["date_time"]}]
+    assert client.get("/events/upcoming", params={"within": 60}).json() == []
+
+    client.post(f"/events/{event_id}/cancel", headers=request_headers)
+    assert client.get("/events/upcoming", params={"within": 3600}).json() == []
+
+
+def test_load_indexes_future_and_running_events(
+    test_db: sa_orm.Session, create_event_response: httpx.Response, event_data: dict, request_headers: dict
+):
+    now = datetime.datetime.now().replace(microsecond=0)
+    created = client.post("/events/bulk", json=[
+        {**event_data, "date_time": (now + datetime.timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")},
+        {**event_data, "date_time": (now - datetime.timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M:%S")},
+    ], headers=request_headers).json()["created"]
+    future, running = (event["id"] for event in created)
+
+    index = scheduler.EventScheduler(ws_manager.ConnectionManager())
+    asyncio.run(index.load(TestingAsyncSessionLocal))
+    assert [event_id for event_id, _ in index.upcoming(7200, 10)] == [future]
+    assert sorted(key % scheduler.ID_LIMIT for key in index.ends) == sorted([future, running])
@@ -0,0 +1,24 @@
+import datetime
+import json
+
+import pydantic
+
+from schemas import events as events_schemas
+
+
+def test_dump_base_events_matches_base_event_serialization():
+    rows = [
+        (1, "Café meetup", datetime.datetime(2024, 10, 27, 13, 0), datetime.timedelta(minutes=60), "Main St", False, None, 0),
+        (2, "Workshop", datetime.datetime(2024, 1, 2, 3, 4, 5, 678), datetime.timedelta(minutes=90), "", True, 20, 20),
+        (3, "Standup", datetime.datetime(2025, 12, 31, 23, 59, 59), datetime.timedelta(minutes=15), "Room 1", False, 5, 3),
+        (4, "Empty", datetime.datetime(2024, 2, 29), datetime.timedelta(0), "Nowhere", False, None, 0),
+    ]
+    events = [dict(zip(events_schemas.BASE_EVENT_COLUMNS, row)) for row in rows]
+    expected = json.dumps(
+        pydantic.TypeAdapter(list[events_schemas.BaseEvent]).dump_python(
+            [events_schemas.BaseEvent.model_validate(event) for event in events], mode="json"
+        ),
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+    assert events_schemas.dump_base_events(rows) == expected
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import zlib
+
+import msgpack
+
+from fastapi.testclient import TestClient
+
+from core import event_log, ws_encoding, ws_manager
+from main import app
+from tests.conftest import TestingAsyncSessionLocal
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0) -> None:
+        self.delay = delay
+        self.sent: list[str] = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, message: bytes):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_broadcast_does_not_wait_for_slow_consumer():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(send_timeout=5)
+        slow, fast = FakeWebSocket(delay=1), FakeWebSocket()
+        await manager.connect(slow)
+        await manager.connect(fast)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await manager.broadcast("event_created", {"id": 1})
+        elapsed = loop.time() - started
+        await asyncio.sleep(0.05)
+        return elapsed, fast.sent, slow.sent
+
+    elapsed, fast_sent, slow_sent = run(scenario())
+    assert elapsed < 0.1
+    assert [json.loads(m)["data"]["id"] for m in fast_sent] == [1]
+    assert slow_sent == []
+
+
+def test_drop_oldest_keeps_latest_messages():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(max_queue_size=2, slow_consumer_policy=ws_manager.DROP_OLDEST)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        for event_id in range(5):
+            await manager.broadcast("event_created", {"id": event_id})
+        await asyncio.sleep(0.05)
+        return websocket.sent, manager.active_connections[websocket].dropped
+
+    sent, dropped = run(scenario())
+    assert [json.loads(m)["data"]["id"] for m in sent] == [3, 4]
+    assert dropped == 3
+
+
+def test_coalesce_replaces_queued_message_for_same_state():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(max_queue_size=2, slow_consumer_policy=ws_manager.COALESCE)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        participant = {"id": 7, "name": "Test User"}
+        await manager.broadcast("event_created", {"id": 1})
+        await manager.broadcast("joined_event", {"id": 1, "participant": participant})
+        await manager.broadcast("left_event", {"id": 1, "participant": participant})
+        await asyncio.sleep(0.05)
+        return websocket.sent
+
+    sent = run(scenario())
+    assert [json.loads(m)["type"] for m in sent] == ["event_created", "left_event"]
+
+
+def test_disconnect_policy_evicts_full_consumer():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(max_queue_size=1, slow_consumer_policy=ws_manager.DISCONNECT)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        await manager.broadcast("event_created", {"id": 1})
+        await manager.broadcast("event_created", {"id": 2})
+        await asyncio.sleep(0.05)
+        return manager.active_connections, websocket
+
+    active_connections, websocket = run(scenario())
+    assert websocket not in active_connections
+    assert websocket.close_code == 1008
+
+
+def test_send_timeout_drops_stalled_connection():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(send_timeout=0.05)
+        websocket = FakeWebSocket(delay=10)
+        await manager.connect(websocket)
+        await manager.broadcast("event_created", {"id": 1})
+        await asyncio.sleep(0.2)
+        # Commands racing the drop find no connection rather than failing.
+        topics = manager.subscribe(websocket, ["events"]), manager.unsubscribe(websocket, ["events"])
+        return manager.active_connections, websocket, topics, manager.connection_count
+
+    active_connections, websocket, topics, connection_count = run(scenario())
+    assert websocket not in active_connections
+    assert websocket.close_code == 1011
+    assert topics == (set(), set())
+    assert connection_count == 0
+
+
+def test_broadcast_reaches_only_subscribed_connections():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(default_topics=[])
+        everything, catalogue, one_event, idle = (FakeWebSocket() for _ in range(4))
+        for websocket in (everything, catalogue, one_event, idle):
+            await manager.connect(websocket)
+        manager.subscribe(everything, [ws_manager.ALL_TOPICS])
+        manager.subscribe(catalogue, [ws_manager.EVENTS_TOPIC])
+        manager.subscribe(one_event, [ws_manager.event_topic(1)])
+        await manager.broadcast("event_created", {"id": 2}, topics=[ws_manager.EVENTS_TOPIC])
+        await manager.broadcast("joined_event", {"id": 1, "participant": {"id": 1}}, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("joined_event", {"id": 3, "participant": {"id": 1}}, topics=[ws_manager.event_topic(3)])
+        await asyncio.sleep(0.05)
+        manager.disconnect(one_event)
+        return [[json.loads(m)["data"]["id"] for m in ws.sent] for ws in (everything, catalogue, one_event, idle)], manager.subscribers
+
+    received, subscribers = run(scenario())
+    assert received == [[2, 1, 3], [2], [1], []]
+    assert ws_manager.event_topic(1) not in subscribers
+
+
+def test_websocket_subscription_commands():
+    client = TestClient(app)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"action": "unsubscribe", "topics": ["*"]}))
+        assert websocket.receive_json() == {"type": "unsubscribed", "data": {"topics": []}}
+        websocket.send_text(json.dumps({"action": "subscribe", "topics": ["events"], "event_ids": [5]}))
+        assert websocket.receive_json() == {"type": "subscribed", "data": {"topics": ["event:5", "events"]}}
+        websocket.send_text(json.dumps({"action": "subscribe", "topics": ["nope"]}))
+        assert websocket.receive_json()["type"] == "error"
+        asyncio.run(ws_manager.manager.broadcast("joined_event", {"id": 6}, topics=[ws_manager.event_topic(6)]))
+        asyncio.run(ws_manager.manager.broadcast("joined_event", {"id": 5}, topics=[ws_manager.event_topic(5)]))
+        message = websocket.receive_json()
+        assert (message["type"], message["data"]) == ("joined_event", {"id": 5})
+
+
+def test_coalescing_merges_participant_changes_per_event():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(coalesce_window=0.02, coalesce_max_messages=100)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        alice, bob, carol = ({"id": user_id, "name": name} for user_id, name in ((1, "Alice"), (2, "Bob"), (3, "Carol")))
+        await manager.broadcast("joined_event", {"id": 1, "participant": alice}, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("joined_event", {"id": 1, "participant": bob}, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("left_event", {"id": 1, "participant": bob}, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("left_event", {"id": 2, "participant": carol}, topics=[ws_manager.event_topic(2)])
+        await asyncio.sleep(0.01)
+        before_window = list(websocket.sent)
+        await asyncio.sleep(0.05)
+        return before_window, websocket.sent
+
+    before_window, sent = run(scenario())
+    assert before_window == []
+    assert [{"type": message["type"], "data": message["data"]} for message in map(json.loads, sent)] == [
+        {"type": "participants_changed", "data": {"events": [{"id": 1, "joined": [{"id": 1, "name": "Alice"}], "left": []}]}},
+        {"type": "participants_changed", "data": {"events": [{"id": 2, "joined": [], "left": [{"id": 3, "name": "Carol"}]}]}},
+    ]
+
+
+def test_coalescing_flushes_before_other_messages_and_at_max_messages():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(coalesce_window=10, coalesce_max_messages=2)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        for user_id in (1, 2, 3):
+            await manager.broadcast("joined_event", {"id": 1, "participant": {"id": user_id, "name": ""}})
+        await manager.broadcast("event_canceled", {"id": 1})
+        await asyncio.sleep(0.01)
+        return websocket.sent
+
+    sent = [json.loads(message) for message in run(scenario())]
+    assert [message["type"] for message in sent] == ["participants_changed", "participants_changed", "event_canceled"]
+    assert [len(message["data"]["events"][0]["joined"]) for message in sent[:2]] == [2, 1]
+
+
+def test_reconnect_replays_missed_messages_for_subscribed_topics():
+    async def scenario():
+        manager = ws_manager.ConnectionManager()
+        first = FakeWebSocket()
+        await manager.connect(first, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("joined_event", {"id": 1, "participant": {"id": 1}}, topics=[ws_manager.event_topic(1)])
+        await asyncio.sleep(0.01)
+        seen = json.loads(first.sent[-1])
+        manager.disconnect(first)
+        await manager.broadcast("joined_event", {"id": 2, "participant": {"id": 1}}, topics=[ws_manager.event_topic(2)])
+        await manager.broadcast("left_event", {"id": 1, "participant": {"id": 1}}, topics=[ws_manager.event_topic(1)])
+        await manager.broadcast("event_created", {"id": 3})
+        second = FakeWebSocket()
+        await manager.connect(second, topics=[ws_manager.event_topic(1)], last_seq=seen["seq"], epoch=seen["epoch"])
+        await asyncio.sleep(0.01)
+        return [json.loads(message) for message in second.sent]
+
+    replayed = run(scenario())
+    assert [(message["type"], message["seq"]) for message in replayed] == [("left_event", 3), ("event_created", 4)]
+
+
+def test_reconnect_requires_resync_when_gap_is_not_retained():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(replay_buffer_size=2)
+        for event_id in range(4):
+            await manager.broadcast("event_created", {"id": event_id})
+        epoch = manager.event_log.epoch
+        replies = []
+        for last_seq, client_epoch in ((1, epoch), (2, epoch), (3, "other"), (9, epoch)):
+            websocket = FakeWebSocket()
+            await manager.connect(websocket, last_seq=last_seq, epoch=client_epoch)
+            await asyncio.sleep(0.01)
+            replies.append([json.loads(message)["type"] for message in websocket.sent])
+        return replies
+
+    assert run(scenario()) == [
+        ["resync_required"],
+        ["event_created", "event_created"],
+        ["resync_required"],
+        ["resync_required"],
+    ]
+
+
+def test_persisted_log_replays_across_restarts(test_db):
+    store = event_log.DatabaseEventStore(TestingAsyncSessionLocal, retention=10)
+
+    async def publish():
+        manager = ws_manager.ConnectionManager(event_store=store)
+        for event_id in range(3):
+            await manager.broadcast("event_created", {"id": event_id})
+
+    async def reconnect():
+        manager = ws_manager.ConnectionManager(event_store=store)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, last_seq=1, epoch=event_log.PERSISTENT_EPOCH)
+        await manager.broadcast("event_canceled", {"id": 0})
+        await asyncio.sleep(0.01)
+        return [json.loads(message) for message in websocket.sent]
+
+    run(publish())
+    replayed = run(reconnect())
+    assert [(message["type"], message["seq"]) for message in replayed] == [
+        ("event_created", 2), ("event_created", 3), ("event_canceled", 4),
+    ]
+    assert replayed[0]["data"] == {"id": 1}
+
+
+def test_broadcast_is_encoded_once_per_negotiated_format(monkeypatch):
+    encoded = []
+    encode = ws_encoding.encode
+    monkeypatch.setattr(ws_encoding, "encode", lambda payload, format: encoded.append(format) or encode(payload, format))
+    formats = [
+        ws_encoding.Format(),
+        ws_encoding.Format(ws_encoding.MSGPACK),
+        ws_encoding.Format(ws_encoding.JSON, ws_encoding.DEFLATE),
+        ws_encoding.Format(ws_encoding.MSGPACK, ws_encoding.DEFLATE),
+    ]
+
+    async def scenario():
+        manager = ws_manager.ConnectionManager()
+        websockets = [FakeWebSocket() for _ in range(8)]
+        for index, websocket in enumerate(websockets):
+            await manager.connect(websocket, format=formats[index % len(formats)])
+        await manager.broadcast("event_created", {"id": 1, "title": "Café"})
+        await asyncio.sleep(0.01)
+        return [websocket.sent[0] for websocket in websockets[:len(formats)]]
+
+    plain, packed, deflated, packed_deflated = run(scenario())
+    assert len(encoded) == len(set(encoded)) == len(formats)
+    decompress = lambda data: zlib.decompress(data, -zlib.MAX_WBITS)
+    expected = json.loads(plain)
+    assert expected["data"] == {"id": 1, "title": "Café"}
+    assert msgpack.unpackb(packed) == expected
+    assert json.loads(decompress(deflated)) == expected
+    assert msgpack.unpackb(decompress(packed_deflated)) == expected
+
+
+def test_websocket_negotiates_encoding():
+    client = TestClient(app)
+    with client.websocket_connect("/ws?encoding=msgpack&compression=deflate") as websocket:
+        websocket.send_text(json.dumps({"action": "unsubscribe", "topics": ["*"]}))
+        reply = msgpack.unpackb(zlib.decompress(websocket.receive_bytes(), -zlib.MAX_WBITS))
+        assert reply == {"type": "unsubscribed", "data": {"topics": []}}
+
+
+def test_shutdown_sends_queued_messages_then_asks_clients_to_reconnect():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(coalesce_window=10)
+        websocket = FakeWebSocket(delay=0.01)
+        await manager.connect(websocket)
+        await manager.broadcast("event_created", {"id": 1})
+        await manager.broadcast("joined_event", {"id": 1, "participant": {"id": 1, "name": ""}})
+        await manager.shutdown()
+        return websocket, manager.active_connections
+
+    websocket, active_connections = run(scenario())
+    assert [json.loads(message)["type"] for message in websocket.sent] == ["event_created", "participants_changed"]
+    assert websocket.close_code == 1012
+    assert not active_connections
+
+
+def test_heartbeat_timer_pings_idle_sockets_and_reaps_silent_ones():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(heartbeat_interval=0.02, idle_timeout=0.05)
+        silent, chatty = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(silent)
+        await manager.connect(chatty)
+        heartbeat_task = manager._heartbeat_task
+        for _ in range(5):
+            await asyncio.sleep(0.02)
+            manager.touch(chatty)
+        await asyncio.sleep(0.01)
+        return manager, heartbeat_task, silent, chatty
+
+    manager, heartbeat_task, silent, chatty = run(scenario())
+    assert manager._heartbeat_task is heartbeat_task
+    assert silent.close_code == 1001 and silent not in manager.active_connections
+    assert chatty in manager.active_connections
+    assert {json.loads(message)["type"] for message in chatty.sent} == {"heartbeat"}
+    assert manager.connection_count == 1
+
+
+def test_connection_limits_per_user_and_global():
+    async def scenario():
+        manager = ws_manager.ConnectionManager(max_connections=3, max_connections_per_user=2)
+        websockets = [FakeWebSocket() for _ in range(5)]
+        accepted = [
+            await manager.connect(websocket, user_key=user_key)
+            for websocket, user_key in zip(websockets, ["a", "a", "a", "b", "c"])
+        ]
+        manager.disconnect(websockets[0])
+        accepted.append(await manager.connect(FakeWebSocket(), user_key="a"))
+        return accepted, websockets, manager.stats()
+
+    accepted, websockets, stats = run(scenario())
+    assert accepted == [True, True, False, True, False, True]
+    assert websockets[2].close_code == websockets[4].close_code == 1013
+    assert stats["connections"] == 3 and stats["users"] == 2
+
+
+def test_anonymous_clients_are_only_limited_per_address_when_configured():
+    async def scenario(max_connections_per_address):
+        manager = ws_manager.ConnectionManager(max_connections_per_user=2, max_connections_per_address=max_connections_per_address)
+        key = f"{ws_manager.ADDRESS_KEY_PREFIX}127.0.0.1"
+        return [await manager.connect(FakeWebSocket(), user_key=key) for _ in range(5)]
+
+    assert run(scenario(0)) == [True] * 5
+    assert run(scenario(3)) == [True, True, True, False, False]